@@ -0,0 +1,68 @@
+import os
+import zlib
+import alpaca_trade_api as tradeapi
+from datetime import datetime, timedelta
+
+from config import parameters
+from database import get_assets, update_assets, get_meta, set_meta
+from market_data import bar_store
+from logs import log_this, ERROR
+
+
+ASSET_ATTRIBUTES = ('exchange', 'tradable', 'shortable', 'fractionable', 'status')
+
+
+def refresh_assets(api, force=False):
+    """ Updates cached assets by the difference with API once per refresh interval. """
+    now = datetime.utcnow()
+    synced_at = get_meta('assets synced at')
+    expired_at = str(now - timedelta(hours=parameters.getfloat('assets refresh interval')))[:19]
+    if not force and synced_at is not None and synced_at >= expired_at:
+        return
+    try:
+        assets = api.list_assets(status='active')
+    except tradeapi.rest.APIError as apierror:
+        log_this('Something went wrong with API while getting the list of assets!', level=ERROR)
+        log_this(str(apierror), notime_flag=True, level=ERROR)
+        return
+    cached = get_assets()
+    fresh = {asset.symbol: tuple(getattr(asset, name, None) for name in ASSET_ATTRIBUTES) for asset in assets}
+    changed = [(symbol,) + attributes for symbol, attributes in fresh.items() if cached.get(symbol) != attributes]
+    removed = [symbol for symbol in cached if symbol not in fresh]
+    update_assets(changed, removed, str(now)[:19])
+    set_meta('assets synced at', str(now)[:19])
+    new_count = sum(1 for symbol, *_ in changed if symbol not in cached)
+    log_this(f'Assets: {new_count} new, {len(changed) - new_count} changed, {len(removed)} removed.')
+
+
+def get_universe(api, symbols_file, shard=(0, 1)):
+    """ Makes the list of symbols to check: tradable assets of the allowed exchanges
+        (only those from the symbols file if it exists) not cheaper than the minimum price.
+        Only symbols of the shard (index, count) are kept. If no assets are cached yet and API has failed,
+        the symbols file is used unchecked, and without it the universe is empty. """
+    refresh_assets(api)
+    assets = get_assets()
+    exchanges = {exchange.strip() for exchange in parameters.get('asset exchanges').split(',') if exchange.strip()}
+    tradable = {symbol for symbol, (exchange, is_tradable, *_) in assets.items()
+                if is_tradable and (not exchanges or exchange in exchanges)}
+    if os.path.exists(symbols_file):
+        with open(symbols_file, 'r') as file:
+            symbols = [line.strip() for line in file.readlines() if line.strip()]
+        if assets:
+            symbols = [symbol for symbol in symbols if symbol in tradable]
+        else:
+            log_this(f'There are no cached assets! Symbols of {symbols_file} are checked without them.', level=ERROR)
+    else:
+        symbols = sorted(tradable)
+        if not assets:
+            log_this('There are no cached assets and no symbols file! The scan is skipped.', level=ERROR)
+    symbols = [symbol for symbol in symbols if is_in_shard(symbol, shard)]
+    minimum_price = parameters.getfloat('minimum price')
+    last_closes = bar_store.get_last_closes()
+    return [symbol for symbol in symbols if last_closes.get(symbol, minimum_price) >= minimum_price]
+
+
+def is_in_shard(symbol, shard):
+    """ Checks whether the symbol belongs to the shard (index, count). The hash is stable between processes. """
+    index, count = shard
+    return zlib.crc32(symbol.encode()) % count == index
@@ -0,0 +1,275 @@
+import sqlite3
+import argparse
+import numpy as np
+import pandas as pd
+from collections import Counter, deque
+from datetime import timedelta
+
+from config import parameters
+from screening import check_bars
+from orders_checks import buy_order_action, sell_order_action, sell_target_price, calculate_profit, unfilled_amount
+from main import order_quantity
+
+
+BARS_COLUMNS = ['symbol', 'time', 'open', 'high', 'low', 'close', 'volume']
+PROFITS_COLUMNS = ['total_balance', 'active_balance', 'time', 'symbol', 'profit', 'buy_order_id', 'sell_order_id']
+EXCHANGE_TIMEZONE = 'America/New_York'
+HOUR = 3600 * 10**9
+
+
+def load_bars(paths):
+    """ Loads historical bars (symbol, time, open, high, low, close, volume) from CSV or Parquet files. """
+    frames = [pd.read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path) for path in paths]
+    bars = pd.concat(frames, ignore_index=True)[BARS_COLUMNS]
+    if pd.api.types.is_numeric_dtype(bars['time']):
+        bars['time'] = pd.to_datetime(bars['time'], unit='s', utc=True)
+    else:
+        bars['time'] = pd.to_datetime(bars['time'])
+    if bars['time'].dt.tz is None:
+        bars['time'] = bars['time'].dt.tz_localize(EXCHANGE_TIMEZONE)
+    else:
+        bars['time'] = bars['time'].dt.tz_convert(EXCHANGE_TIMEZONE)
+    return bars
+
+
+def prepare_steps(bars, step_minutes=None):
+    """ Aggregates bars into check steps (every bar for daily bars, every step_minutes for minute bars).
+        For every step and symbol keeps the bar of the step itself, which fills the orders, and today's bar
+        up to the step, which is screened. Returns columnar arrays sorted by step and symbol. """
+    symbols, codes = np.unique(bars['symbol'].to_numpy().astype(str), return_inverse=True)
+    time = bars['time']
+    frame = pd.DataFrame({'symbol': codes,
+                          'day': time.dt.tz_localize(None).dt.normalize(),
+                          'step': time.dt.ceil(f'{step_minutes}min') if step_minutes else time,
+                          'time': time,
+                          'open': bars['open'].to_numpy(dtype=np.float64),
+                          'high': bars['high'].to_numpy(dtype=np.float64),
+                          'low': bars['low'].to_numpy(dtype=np.float64),
+                          'close': bars['close'].to_numpy(dtype=np.float64),
+                          'volume': bars['volume'].to_numpy(dtype=np.float64)})
+    frame = frame.sort_values(['symbol', 'time'], kind='stable')
+    steps = frame.groupby(['symbol', 'day', 'step'], sort=True).agg(
+        open=('open', 'first'), high=('high', 'max'), low=('low', 'min'),
+        close=('close', 'last'), volume=('volume', 'sum')).reset_index()
+    by_day = steps.groupby(['symbol', 'day'], sort=False)
+    steps['today_high'] = by_day['high'].cummax()
+    steps['today_low'] = by_day['low'].cummin()
+    steps['today_volume'] = by_day['volume'].cumsum()
+    day_volume = by_day['volume'].sum().sort_index()
+    yesterday_volume = day_volume.groupby(level='symbol').shift(1)
+    steps['yesterday_volume'] = yesterday_volume.reindex(pd.MultiIndex.from_frame(steps[['symbol', 'day']])).to_numpy()
+    steps = steps.sort_values(['step', 'symbol'], kind='stable')
+    data = {column: steps[column].to_numpy() for column in ('symbol', 'open', 'high', 'low', 'close', 'today_high',
+                                                           'today_low', 'today_volume', 'yesterday_volume')}
+    data['step'] = steps['step'].dt.tz_convert('UTC').dt.tz_localize(None).to_numpy().astype('datetime64[ns]')
+    data['symbols'] = symbols
+    return data
+
+
+class SimulatedOrder:
+    """ An order of the simulated broker. """
+
+    def __init__(self, order_id, symbol, side, order_type, qty, created_at, limit_price=None):
+        self.id = order_id
+        self.symbol = symbol
+        self.side = side
+        self.type = order_type
+        self.qty = qty
+        self.limit_price = limit_price
+        self.created_at = created_at
+        self.status = 'new'
+        self.filled_qty = 0
+        self.filled_avg_price = None
+
+
+class SimulatedBroker:
+    """ Keeps simulated orders and fills them by the bars of each step.
+        Limit orders are filled at their limit price once the step's range reaches it,
+        market orders at the open of the next step. Partial fills are not simulated. """
+
+    def __init__(self):
+        self.open_orders = dict()
+        self._last_id = 0
+
+    def submit_order(self, symbol, side, order_type, qty, created_at, limit_price=None):
+        """ Submits a new order. """
+        self._last_id += 1
+        order = SimulatedOrder(str(self._last_id), symbol, side, order_type, qty, created_at, limit_price)
+        self.open_orders[order.id] = order
+        return order
+
+    def cancel_order(self, order):
+        """ Cancels an order. """
+        order.status = 'canceled'
+        self.open_orders.pop(order.id, None)
+
+    def fill(self, codes, opens, highs, lows):
+        """ Fills open orders by the bars of a step (arrays sorted by symbol code). """
+        for order in list(self.open_orders.values()):
+            index = np.searchsorted(codes, order.symbol)
+            if index == len(codes) or codes[index] != order.symbol:
+                continue
+            if order.type == 'market':
+                price = opens[index]
+            elif order.side == 'buy' and lows[index] <= order.limit_price:
+                price = order.limit_price
+            elif order.side == 'sell' and highs[index] >= order.limit_price:
+                price = order.limit_price
+            else:
+                continue
+            order.status = 'filled'
+            order.filled_qty = order.qty
+            order.filled_avg_price = price
+            del self.open_orders[order.id]
+
+
+def run_backtest(data, settings=parameters):
+    """ Replays prepared steps through the screening and order checks with a simulated broker.
+        Returns a profits-compatible ledger and a summary. """
+    broker = SimulatedBroker()
+    symbols = data['symbols']
+    steps = data['step'].view(np.int64)
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(steps)) + 1, [len(steps)]))
+    total_balance = active_balance = settings.getfloat('initial funds')
+    ledger = list()
+    buy_orders = dict()
+    sell_orders = dict()
+    symbol_counts = Counter()
+    hourly_orders = deque()
+    symbolic_limitation = settings.getint('symbolic limitation')
+    hourly_limitation = settings.getint('hourly limitation')
+
+    def time_of(step_time):
+        return str(pd.Timestamp(step_time))[:19]
+
+    def make_sell(buy_order, order_type, quantity, step_time, limit_price=None):
+        sell_order = broker.submit_order(buy_order.symbol, 'sell', order_type, quantity, step_time, limit_price)
+        sell_orders[sell_order.id] = (sell_order, buy_order)
+        symbol_counts[buy_order.symbol] += 1
+
+    def forget(orders, order):
+        del orders[order.id]
+        symbol_counts[order.symbol] -= 1
+
+    def release_funds(buy_order, step_time):
+        nonlocal total_balance, active_balance
+        amount = unfilled_amount(buy_order.qty, buy_order.filled_qty, buy_order.limit_price)
+        if amount > 0:
+            total_balance += amount
+            active_balance += amount
+            ledger.append((total_balance, active_balance, time_of(step_time), symbols[buy_order.symbol],
+                           0, buy_order.id, 'None'))
+
+    def take_profit(buy_order, sell_order, step_time):
+        nonlocal total_balance, active_balance
+        profit, total_income, active_income = calculate_profit(buy_order.limit_price, sell_order.filled_avg_price,
+                                                               sell_order.filled_qty, settings)
+        total_balance += total_income
+        active_balance += active_income
+        ledger.append((total_balance, active_balance, time_of(step_time), symbols[buy_order.symbol],
+                       profit, buy_order.id, sell_order.id))
+
+    ledger.append((total_balance, active_balance, time_of(steps[0]) if len(steps) else '', 'None', 0, 'None', 'None'))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        step_time = steps[start]
+        codes = data['symbol'][start:end]
+        broker.fill(codes, data['open'][start:end], data['high'][start:end], data['low'][start:end])
+
+        # Scan
+        yesterday_volume = data['yesterday_volume'][start:end]
+        close = data['close'][start:end]
+        passed, target_price, gap, volume = check_bars(yesterday_volume, data['today_volume'][start:end],
+                                                       data['today_low'][start:end], data['today_high'][start:end],
+                                                       close, settings)
+        passed &= ~np.isnan(yesterday_volume)
+        candidates = np.flatnonzero(passed)
+        candidates = candidates[np.lexsort((-volume[candidates], gap[candidates]))]
+        while hourly_orders and hourly_orders[0] <= step_time - HOUR:
+            hourly_orders.popleft()
+        for index in candidates:
+            if len(hourly_orders) >= hourly_limitation:
+                break
+            symbol, price = codes[index], close[index]
+            if symbol_counts[symbol] >= symbolic_limitation or active_balance <= price:
+                continue
+            quantity = order_quantity(active_balance, price, settings)
+            if quantity <= 0:
+                continue
+            order = broker.submit_order(symbol, 'buy', 'limit', quantity, step_time, price)
+            buy_orders[order.id] = order
+            symbol_counts[symbol] += 1
+            hourly_orders.append(step_time)
+            total_balance -= quantity * price
+            active_balance -= quantity * price
+            ledger.append((total_balance, active_balance, time_of(step_time), symbols[symbol], 0, 'None', 'None'))
+
+        # Checks
+        for order in list(buy_orders.values()):
+            order_time = timedelta(microseconds=int(step_time - order.created_at) // 1000)
+            action = buy_order_action(order.status, order.filled_qty, order_time, settings)
+            if action == 'limit sell':
+                make_sell(order, 'limit', order.qty, step_time, sell_target_price(order.limit_price, settings))
+                forget(buy_orders, order)
+            elif action in ('market sell', 'cancel and market sell'):
+                broker.cancel_order(order)
+                make_sell(order, 'market', order.filled_qty, step_time)
+                release_funds(order, step_time)
+                forget(buy_orders, order)
+            elif action in ('forget', 'cancel'):
+                broker.cancel_order(order)
+                release_funds(order, step_time)
+                forget(buy_orders, order)
+        for order, buy_order in list(sell_orders.values()):
+            order_time = timedelta(microseconds=int(step_time - order.created_at) // 1000)
+            action = sell_order_action(order.status, order.type, order_time, settings)
+            if action == 'take profit':
+                take_profit(buy_order, order, step_time)
+                forget(sell_orders, order)
+            elif action == 'cancel and sell rest':
+                broker.cancel_order(order)
+                make_sell(buy_order, 'market', order.qty - order.filled_qty, step_time)
+                take_profit(buy_order, order, step_time)
+                forget(sell_orders, order)
+            elif action == 'cancel and market sell':
+                broker.cancel_order(order)
+                forget(sell_orders, order)
+                make_sell(buy_order, 'market', order.qty, step_time)
+    ledger = pd.DataFrame.from_records(ledger, columns=PROFITS_COLUMNS)
+    return ledger, summarize(ledger, len(buy_orders) + len(sell_orders))
+
+
+def summarize(ledger, open_orders=0):
+    """ Calculates total profit, win rate and maximal drawdown of a ledger. """
+    trades = ledger[ledger['sell_order_id'] != 'None']
+    cumulative_profit = ledger['profit'].cumsum()
+    drawdown = (cumulative_profit.cummax() - cumulative_profit).max() if len(ledger) else 0
+    return {'total profit': round(float(ledger['profit'].sum()), 2),
+            'trades': len(trades),
+            'win rate': round(float((trades['profit'] > 0).mean()), 4) if len(trades) else 0,
+            'max drawdown': round(float(drawdown), 2),
+            'total balance': round(float(ledger['total_balance'].iloc[-1]), 2) if len(ledger) else 0,
+            'active balance': round(float(ledger['active_balance'].iloc[-1]), 2) if len(ledger) else 0,
+            'open orders': open_orders}
+
+
+def save_ledger(ledger, path):
+    """ Saves a ledger as the profits table of an SQLite database. """
+    ledger = ledger.copy()
+    ledger.index = ledger.index + 1
+    conn = sqlite3.connect(path)
+    ledger.to_sql('profits', conn, if_exists='replace', index_label='id')
+    conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays historical bars through the trading rules.')
+    parser.add_argument('bars', nargs='+', help='CSV or Parquet files with symbol, time, open, high, low, close, '
+                                                'volume columns')
+    parser.add_argument('--timeframe', choices=('day', 'minute'), default='day')
+    parser.add_argument('--ledger', default='backtest.db', help='SQLite file for the profits ledger')
+    args = parser.parse_args()
+    step_minutes = parameters.getint('scan interval') if args.timeframe == 'minute' else None
+    result_ledger, summary = run_backtest(prepare_steps(load_bars(args.bars), step_minutes))
+    save_ledger(result_ledger, args.ledger)
+    for key, value in summary.items():
+        print(f'{key}: {value}')
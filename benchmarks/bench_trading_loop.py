@@ -0,0 +1,35 @@
+import main
+from orders_checks import check_orders
+
+
+def test_run(benchmark, bot):
+    """ The whole run on a fresh database: scan of the universe and checks of the placed orders. """
+    benchmark.pedantic(main.run, setup=bot.reset, rounds=3)
+    bot.report(benchmark)
+
+
+def test_cold_scan(benchmark, bot):
+    """ The first scan: the asset cache and the bar store are empty. """
+    benchmark.pedantic(main.scan, args=(bot.api,), setup=bot.reset, rounds=3)
+    bot.report(benchmark)
+
+
+def test_warm_scan(benchmark, bot):
+    """ A repeated scan: assets are cached and only today's bars are requested. """
+    def setup():
+        bot.reset()
+        main.scan(bot.api)
+        bot.clear_counters()
+    benchmark.pedantic(main.scan, args=(bot.api,), setup=setup, rounds=3)
+    bot.report(benchmark)
+
+
+def test_check_orders(benchmark, bot):
+    """ Checks of filled buy orders: a limit sell order is placed for each of them. """
+    def setup():
+        bot.reset()
+        main.scan(bot.api)
+        bot.api.advance()
+        bot.clear_counters()
+    benchmark.pedantic(check_orders, args=(bot.api,), setup=setup, rounds=3)
+    bot.report(benchmark)
@@ -0,0 +1,54 @@
+import os
+import pytest
+
+import main
+import database
+import market_data
+from journal import journal
+from limits import hourly_limiter
+from metrics import metrics
+from fake_broker import FakeREST
+
+
+UNIVERSE_SIZES = {'100': 100, '1k': 1000, '10k': 10000}
+
+
+class Bot:
+    """ The bot modules working on a fresh database and bar store in a directory, with a fake broker. """
+
+    def __init__(self, directory, symbols_count, latency=0.0):
+        self.directory = directory
+        self.api = FakeREST(symbols_count, latency)
+
+    def reset(self):
+        """ Drops the database, the bar store, the broker orders and all counters. """
+        database.db.close()
+        market_data.bar_store.close()
+        journal.close()
+        for name in os.listdir(self.directory):
+            if name.startswith(('data.db', 'bars.db', 'journal.db')):
+                os.remove(os.path.join(self.directory, name))
+        self.api.orders.clear()
+        hourly_limiter._times.clear()
+        self.clear_counters()
+
+    def clear_counters(self):
+        """ Starts counting API calls and DB operations from zero. """
+        self.api.calls.clear()
+        metrics.reset()
+
+    def report(self, benchmark):
+        """ Adds API call and DB operation counts of the last round to the benchmark. """
+        db_spans = {name: count for name, (count, _, _) in metrics.spans.items() if name.startswith('db.')}
+        benchmark.extra_info['api calls'] = dict(self.api.calls)
+        benchmark.extra_info['api calls total'] = sum(self.api.calls.values())
+        benchmark.extra_info['db operations'] = db_spans
+        benchmark.extra_info['db operations total'] = sum(db_spans.values())
+        benchmark.extra_info['orders'] = len(self.api.orders)
+
+
+@pytest.fixture(params=list(UNIVERSE_SIZES), ids=list(UNIVERSE_SIZES))
+def bot(request, workdir, monkeypatch):
+    fake_bot = Bot(str(workdir), UNIVERSE_SIZES[request.param])
+    monkeypatch.setattr(main.tradeapi, 'REST', lambda *args, **kwargs: fake_bot.api)
+    return fake_bot
@@ -1,7 +1,10 @@
+import os
 import configparser
 
 
+SETTINGS_FILE = os.environ.get('SETTINGS_FILE', 'settings.ini')
+
 config = configparser.ConfigParser()
-config.read('settings.ini')
+config.read(SETTINGS_FILE)
 api_keys = config['api keys']
 parameters = config['parameters']
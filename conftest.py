@@ -0,0 +1,37 @@
+import pytest
+from collections import deque
+
+import database
+import market_data
+from journal import journal, JOURNAL_FILE
+from logs import logger
+from limits import hourly_limiter
+from orders import pending_buys
+from order_queue import order_queue
+
+
+@pytest.fixture(autouse=True)
+def quiet(monkeypatch):
+    monkeypatch.setattr(logger, 'to_file', False)
+    monkeypatch.setattr(logger, 'to_screen', False)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """ Runs the bot in a temporary directory on a fresh database, bar store and journal,
+        without the hourly limitation and queued orders of other tests. Shared by the tests and the benchmarks. """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database.db, 'path', str(tmp_path / database.DATABASE_FILE))
+    monkeypatch.setattr(market_data.bar_store, 'path', str(tmp_path / market_data.BARS_DATABASE_FILE))
+    monkeypatch.setattr(journal, 'path', str(tmp_path / JOURNAL_FILE))
+    monkeypatch.setattr(hourly_limiter, 'limit', 10 ** 6)
+    monkeypatch.setattr(hourly_limiter, '_times', deque())
+    monkeypatch.setattr(hourly_limiter, '_reserved', dict())
+    # The fake broker has no rate limit
+    monkeypatch.setattr(order_queue._bucket, 'rate', 10 ** 6)
+    pending_buys.clear()
+    yield tmp_path
+    pending_buys.clear()
+    database.db.close()
+    market_data.bar_store.close()
+    journal.close()
@@ -1,28 +1,209 @@
 import sqlite3
 import os
-from datetime import datetime, timedelta
+import atexit
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
 
 from config import parameters
-from logs import log_this
+from logs import log_this, DEBUG, ERROR
+from metrics import timed, span
 
 
-def check_database_existence():
-    """ Creating a new database if not exist. """
-    if not os.path.exists('data.db'):
+DATABASE_FILE = 'data.db'
+ORDERS_TABLES = {'buy': 'buy_orders', 'sell': 'sell_orders'}
+# Each script upgrades the schema by one version (PRAGMA user_version)
+MIGRATIONS = [
+    '''CREATE INDEX IF NOT EXISTS "buy_orders_symbol" ON "buy_orders" ("symbol");
+       CREATE INDEX IF NOT EXISTS "sell_orders_symbol" ON "sell_orders" ("symbol");
+       CREATE INDEX IF NOT EXISTS "profits_time" ON "profits" ("time");''',
+    '''CREATE TABLE IF NOT EXISTS "hourly_orders" ("id"	TEXT NOT NULL UNIQUE,
+                                                 "time"	TEXT NOT NULL,
+                                                 PRIMARY KEY("id")
+                                                 );
+       CREATE INDEX IF NOT EXISTS "hourly_orders_time" ON "hourly_orders" ("time");
+       CREATE TABLE IF NOT EXISTS "meta" ("key"	TEXT NOT NULL UNIQUE,
+                                          "value"	TEXT,
+                                          PRIMARY KEY("key")
+                                          );''',
+    '''CREATE TABLE IF NOT EXISTS "assets" ("symbol"	TEXT NOT NULL UNIQUE,
+                                          "exchange"	TEXT,
+                                          "tradable"	INTEGER,
+                                          "shortable"	INTEGER,
+                                          "fractionable"	INTEGER,
+                                          "status"	TEXT,
+                                          "updated_at"	TEXT,
+                                          PRIMARY KEY("symbol")
+                                          );''',
+    '''CREATE TABLE IF NOT EXISTS "runs" ("id"	INTEGER NOT NULL UNIQUE,
+                                        "started_at"	TEXT NOT NULL,
+                                        "duration"	REAL,
+                                        "summary"	TEXT,
+                                        PRIMARY KEY("id" AUTOINCREMENT)
+                                        );''',
+    '''CREATE TABLE IF NOT EXISTS "applied_intents" ("client_order_id"	TEXT NOT NULL UNIQUE,
+                                                   "order_id"	TEXT NOT NULL,
+                                                   PRIMARY KEY("client_order_id")
+                                                   );''',
+    '''CREATE TABLE IF NOT EXISTS "daily_pnl" ("day"	TEXT NOT NULL UNIQUE,
+                                             "profit"	REAL NOT NULL DEFAULT 0,
+                                             "trades"	INTEGER NOT NULL DEFAULT 0,
+                                             "wins"	INTEGER NOT NULL DEFAULT 0,
+                                             "hold_seconds"	REAL NOT NULL DEFAULT 0,
+                                             "held_trades"	INTEGER NOT NULL DEFAULT 0,
+                                             "total_balance"	REAL,
+                                             "active_balance"	REAL,
+                                             PRIMARY KEY("day")
+                                             );
+       CREATE TABLE IF NOT EXISTS "symbol_pnl" ("symbol"	TEXT NOT NULL UNIQUE,
+                                              "profit"	REAL NOT NULL DEFAULT 0,
+                                              "trades"	INTEGER NOT NULL DEFAULT 0,
+                                              "wins"	INTEGER NOT NULL DEFAULT 0,
+                                              "hold_seconds"	REAL NOT NULL DEFAULT 0,
+                                              "held_trades"	INTEGER NOT NULL DEFAULT 0,
+                                              PRIMARY KEY("symbol")
+                                              );
+       CREATE TABLE IF NOT EXISTS "pnl_totals" ("id"	INTEGER NOT NULL UNIQUE CHECK ("id" = 1),
+                                              "profit"	REAL NOT NULL DEFAULT 0,
+                                              "trades"	INTEGER NOT NULL DEFAULT 0,
+                                              "wins"	INTEGER NOT NULL DEFAULT 0,
+                                              "hold_seconds"	REAL NOT NULL DEFAULT 0,
+                                              "held_trades"	INTEGER NOT NULL DEFAULT 0,
+                                              PRIMARY KEY("id")
+                                              );
+       INSERT OR REPLACE INTO daily_pnl (day, profit, trades, wins, total_balance, active_balance)
+           SELECT substr(time, 1, 10), TOTAL(profit), SUM(sell_order_id != 'None'),
+                  SUM(sell_order_id != 'None' AND profit > 0), NULL, NULL
+           FROM profits GROUP BY substr(time, 1, 10);
+       UPDATE daily_pnl SET (total_balance, active_balance) =
+           (SELECT total_balance, active_balance FROM profits
+            WHERE substr(time, 1, 10) = daily_pnl.day ORDER BY id DESC LIMIT 1);
+       INSERT OR REPLACE INTO symbol_pnl (symbol, profit, trades, wins)
+           SELECT symbol, TOTAL(profit), COUNT(id), SUM(profit > 0)
+           FROM profits WHERE sell_order_id != 'None' GROUP BY symbol;
+       INSERT OR REPLACE INTO pnl_totals (id, profit, trades, wins)
+           SELECT 1, TOTAL(profit), TOTAL(trades), TOTAL(wins) FROM daily_pnl;''',
+]
+# Profit, trades, wins, hold time of trades, trades with known hold time
+PNL_COLUMNS = ('profit', 'trades', 'wins', 'hold_seconds', 'held_trades')
+
+
+class Database:
+    """ Keeps one connection to the database and groups writes into transactions.
+        Order counts by symbol and the current balances are cached in memory. """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._transaction_depth = 0
+        self._is_failed = False
+        self._after_commit = list()
+        self._symbol_counts = {table: Counter() for table in ORDERS_TABLES.values()}
+        self._balances = {'total': 0, 'active': 0}
+
+    def connection(self):
+        """ Opens the connection on first use. """
+        if self._conn is None:
+            is_new = not os.path.exists(self.path)
+            self._conn = sqlite3.connect(self.path, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self.check_database_existence(is_new)
+            self.load_cache()
+        return self._conn
+
+    def load_cache(self):
+        """ Loads order counts by symbol and the current balances. """
         try:
-            conn = sqlite3.connect('data.db')
-            cur = conn.cursor()
-            script = '''CREATE TABLE "buy_orders" ( "id"	TEXT NOT NULL UNIQUE,
+            for table, counts in self._symbol_counts.items():
+                counts.clear()
+                counts.update(dict(self._conn.execute(f'SELECT symbol, COUNT(id) FROM {table} GROUP BY symbol')))
+            row = self._conn.execute('SELECT total_balance, active_balance FROM profits ORDER BY id DESC LIMIT 1')
+            self._balances['total'], self._balances['active'] = row.fetchone()
+        except:
+            log_this('Something went wrong while loading the cache from the database!', level=ERROR)
+
+    def close(self):
+        """ Closes the connection. """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @contextmanager
+    def transaction(self):
+        """ Commits all writes inside the block at once. Nested blocks join the outer one.
+            If a nested block has failed, the whole transaction is rolled back, even if the error is caught. """
+        conn = self.connection()
+        if self._transaction_depth == 0:
+            conn.execute('BEGIN')
+        self._transaction_depth += 1
+        try:
+            yield conn
+        except:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.rollback()
+            else:
+                self._is_failed = True
+            raise
+        else:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                if self._is_failed:
+                    self.rollback()
+                    log_this('Something went wrong inside a transaction! It has been rolled back.', level=ERROR)
+                    return
+                with span('db.commit'):
+                    conn.execute('COMMIT')
+                callbacks, self._after_commit = self._after_commit, list()
+                for callback in callbacks:
+                    callback()
+
+    def rollback(self):
+        """ Rolls back the transaction, drops its callbacks and reloads the cache. """
+        self._conn.execute('ROLLBACK')
+        self._is_failed = False
+        self._after_commit.clear()
+        self.load_cache()
+
+    def after_commit(self, callback):
+        """ Calls back once the current transaction is committed (at once outside of transactions).
+            Callbacks of a rolled back transaction are dropped. """
+        if self._transaction_depth == 0:
+            callback()
+        else:
+            self._after_commit.append(callback)
+
+    def check_database_existence(self, is_new):
+        """ Creating tables of a new database and upgrading the schema. """
+        if is_new:
+            self.create_tables()
+        try:
+            version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+            for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+                self._conn.executescript(script)
+                self._conn.execute(f'PRAGMA user_version = {number}')
+        except:
+            log_this('Something went wrong while upgrading the database!', level=ERROR)
+        if is_new:
+            time_now = str(datetime.utcnow())[:19]
+            self.insert_profit(parameters.getfloat('initial funds'), parameters.getfloat('initial funds'),
+                               time_now, 'None', 0, 'None', 'None', nolog_flag=True)
+
+    def create_tables(self):
+        """ Creating tables of a new database. """
+        try:
+            script = '''CREATE TABLE IF NOT EXISTS "buy_orders" ( "id"	TEXT NOT NULL UNIQUE,
                                                     "symbol"	TEXT NOT NULL,
                                                     "checked_at"	TEXT,
                                                     PRIMARY KEY("id")
                                                     );
-                        CREATE TABLE "sell_orders" ("id"	TEXT NOT NULL UNIQUE,
+                        CREATE TABLE IF NOT EXISTS "sell_orders" ("id"	TEXT NOT NULL UNIQUE,
                                                     "symbol"	TEXT NOT NULL,
                                                     "buy_order_id"	TEXT,
                                                     PRIMARY KEY("id")
                                                     );
-                        CREATE TABLE "profits" ("id"	INTEGER NOT NULL UNIQUE,
+                        CREATE TABLE IF NOT EXISTS "profits" ("id"	INTEGER NOT NULL UNIQUE,
                                                 "total_balance"	REAL,
                                                 "active_balance"	REAL,
                                                 "time"	TEXT NOT NULL,
@@ -32,175 +213,318 @@ def check_database_existence():
                                                 "sell_order_id"	TEXT NOT NULL,
                                                 PRIMARY KEY("id" AUTOINCREMENT)
                                                 );'''
-            cur.executescript(script)
-            conn.commit()
-            conn.close()
-            time_now = str(datetime.utcnow())[:19]
-            insert_profit(parameters.getfloat('initial funds'), parameters.getfloat('initial funds'),
-                          time_now, 'None', 0, 'None', 'None', nolog_flag=True)
-        except:
-            log_this('Something went wrong while creating the new database!')
-
-
-def insert_into_database(order_id, symbol, buy_order_id=None):
-    """ Adding a new order into database. """
-    check_database_existence()
-    try:
-        conn = sqlite3.connect('data.db')
-        cur = conn.cursor()
-        if buy_order_id:
-            table = "sell_orders"
-            heads = "id, symbol, buy_order_id"
-            values = f"'{order_id}', '{symbol}', '{buy_order_id}'"
-        else:
-            table = "buy_orders"
-            heads = "id, symbol"
-            values = f"'{order_id}', '{symbol}'"
-        cur.execute(f"INSERT INTO {table} ({heads}) VALUES ({values})")
-        conn.commit()
-        conn.close()
-        log_this(f'Database: Order {order_id} has been inserted into the {table} table.')
-    except:
-        log_this(f'Something went wrong while inserting into the database! ({order_id}, {symbol}, {buy_order_id})')
-
-
-def update_database(side, order_id, check_time):
-    """ Adding a checked_at into order record. """
-    check_database_existence()
-    try:
-        conn = sqlite3.connect('data.db')
-        cur = conn.cursor()
-        cur.execute(f"UPDATE {side}_orders SET checked_at = '{check_time}' WHERE id='{order_id}'")
-        conn.commit()
-        conn.close()
-    except:
-        log_this(f'Something went wrong while updating the database! ({side}_orders, {order_id}, {check_time})')
-
-
-def delete_from_database(side, order_id):
-    """ Deleting an order from database. """
-    check_database_existence()
-    try:
-        conn = sqlite3.connect('data.db')
-        cur = conn.cursor()
-        cur.execute(f"DELETE FROM {side}_orders WHERE id='{order_id}'")
-        conn.commit()
-        conn.close()
-        log_this(f'Database: Order {order_id} has been deleted from the {side}_orders table.')
-    except:
-        log_this(f'Something went wrong while deleting from the database! ({side}_orders, {order_id})')
-
-
-def get_buy_order_id(order_id):
-    """ Getting buy_order_id from sell order record. """
-    check_database_existence()
-    try:
-        conn = sqlite3.connect('data.db')
-        cur = conn.cursor()
-        cur.execute(f"SELECT buy_order_id FROM sell_orders WHERE id='{order_id}'")
-        buy_order_id = cur.fetchone()[0]
-        conn.close()
-        return buy_order_id
-    except:
-        log_this('Something went wrong while getting buy_order_id from the database!')
-        return 'None'
-
-
-def get_list_of_orders(table):
-    """ Getting list of orders id from the table. """
-    check_database_existence()
-    try:
-        conn = sqlite3.connect('data.db')
-        cur = conn.cursor()
-        cur.execute(f"SELECT id FROM {table}")
-        list_of_orders = list()
-        for order_id in cur.fetchall():
-            list_of_orders.append(order_id[0])
-        conn.close()
-        return list_of_orders
-    except:
-        log_this('Something went wrong while getting list of orders from the database!')
-        return []
-
-
-def insert_profit(total_balance, active_balance, time, symbol, profit,
-                  buy_order_id, sell_order_id, nolog_flag=False):
-    """ Adding a new profit info into database. """
-    check_database_existence()
-    try:
-        conn = sqlite3.connect('data.db')
-        cur = conn.cursor()
-        heads = 'total_balance, active_balance, time, symbol, profit, buy_order_id, sell_order_id'
-        values = (f"{total_balance}, {active_balance}, '{time}', '{symbol}', "
-                  f"{profit}, '{buy_order_id}', '{sell_order_id}'")
-        cur.execute(f"INSERT INTO profits ({heads}) VALUES ({values})")
-        conn.commit()
-        conn.close()
-        if not nolog_flag:
-            log_this(f'Database: Profit ${profit} by {symbol} has been inserted into the table.')
-    except:
-        log_this(f'Something went wrong while inserting into the database! '
-                 f'({total_balance}, {active_balance}, {time}, {symbol}, '
-                 f'{profit}, {buy_order_id}, {sell_order_id})')
-
-
-def get_balance(prefix):
-    """ Getting current balance. """
-    check_database_existence()
-    try:
-        conn = sqlite3.connect('data.db')
-        cur = conn.cursor()
-        cur.execute(f"SELECT {prefix}_balance FROM profits ORDER BY id DESC")
-        balance = cur.fetchone()[0]
-        conn.close()
-        return balance
-    except:
-        log_this(f'Something went wrong while getting {prefix}_balance from the database!')
-        return 0
-
-
-def get_total_profit():
-    """ Getting total profit. """
-    check_database_existence()
-    try:
-        conn = sqlite3.connect('data.db')
-        cur = conn.cursor()
-        cur.execute(f"SELECT SUM(profit) FROM profits")
-        total_profit = cur.fetchone()[0]
-        conn.close()
-        return round(total_profit, 2)
-    except:
-        log_this('Something went wrong while getting total profit from the database!')
-        return 0
-
-
-def get_todays_profit():
-    """ Getting today's profit. """
-    check_database_existence()
-    try:
-        today = str(datetime.date(datetime.utcnow()))
-        tomorrow = str(datetime.date(datetime.utcnow() + timedelta(days=1)))
-        conn = sqlite3.connect('data.db')
-        cur = conn.cursor()
-        cur.execute(f"SELECT SUM(profit) FROM profits WHERE time>'{today}' AND time<'{tomorrow}'")
-        todays_profit = cur.fetchone()[0]
-        conn.close()
-        return round(todays_profit, 2)
-    except:
-        log_this('Something went wrong while getting total profit from the database!')
-        return 0
-
-
-def get_symbol_count(symbol, table):
-    """ Getting count of orders with symbol from the table. """
-    check_database_existence()
-    try:
-        conn = sqlite3.connect('data.db')
-        cur = conn.cursor()
-        cur.execute(f"SELECT COUNT(symbol) FROM {table} WHERE symbol='{symbol}'")
-        count = cur.fetchone()[0]
-        conn.close()
-        return count
-    except:
-        log_this(f'Something went wrong while count of orders with {symbol} from the database!')
-        return 0
+            self._conn.executescript(script)
+        except:
+            log_this('Something went wrong while creating the new database!', level=ERROR)
+
+    @timed('db.insert_into_database')
+    def insert_into_database(self, order_id, symbol, buy_order_id=None):
+        """ Adding a new order into database. An order which is already there is kept,
+            so an order found again after a recovery is recorded once. """
+        table = 'sell_orders' if buy_order_id else 'buy_orders'
+        try:
+            with self.transaction() as conn:
+                if buy_order_id:
+                    cur = conn.execute('INSERT OR IGNORE INTO sell_orders (id, symbol, buy_order_id) VALUES (?, ?, ?)',
+                                       (order_id, symbol, buy_order_id))
+                else:
+                    cur = conn.execute('INSERT OR IGNORE INTO buy_orders (id, symbol) VALUES (?, ?)',
+                                       (order_id, symbol))
+                self._symbol_counts[table][symbol] += cur.rowcount
+            log_this('Database: Order %s has been inserted into the %s table.', order_id, table, level=DEBUG)
+        except:
+            log_this(f'Something went wrong while inserting into the database! ({order_id}, {symbol}, {buy_order_id})',
+                     level=ERROR)
+
+    @timed('db.update_database')
+    def update_database(self, side, order_id, check_time):
+        """ Adding a checked_at into order record. """
+        try:
+            with self.transaction() as conn:
+                conn.execute(f'UPDATE {ORDERS_TABLES[side]} SET checked_at = ? WHERE id = ?', (check_time, order_id))
+        except:
+            log_this(f'Something went wrong while updating the database! ({side}_orders, {order_id}, {check_time})',
+                     level=ERROR)
+
+    @timed('db.delete_from_database')
+    def delete_from_database(self, side, order_id):
+        """ Deleting an order from database. """
+        try:
+            table = ORDERS_TABLES[side]
+            with self.transaction() as conn:
+                for symbol, in conn.execute(f'SELECT symbol FROM {table} WHERE id = ?', (order_id,)).fetchall():
+                    conn.execute(f'DELETE FROM {table} WHERE id = ?', (order_id,))
+                    self._symbol_counts[table][symbol] -= 1
+            log_this('Database: Order %s has been deleted from the %s_orders table.', order_id, side, level=DEBUG)
+        except:
+            log_this(f'Something went wrong while deleting from the database! ({side}_orders, {order_id})', level=ERROR)
+
+    @timed('db.get_buy_order_id')
+    def get_buy_order_id(self, order_id):
+        """ Getting buy_order_id from sell order record. """
+        try:
+            cur = self.connection().execute('SELECT buy_order_id FROM sell_orders WHERE id = ?', (order_id,))
+            return cur.fetchone()[0]
+        except:
+            log_this('Something went wrong while getting buy_order_id from the database!', level=ERROR)
+            return 'None'
+
+    @timed('db.get_order_side')
+    def get_order_side(self, order_id):
+        """ Getting the side of a tracked order or None if it isn't tracked. """
+        try:
+            for side, table in ORDERS_TABLES.items():
+                if self.connection().execute(f'SELECT id FROM {table} WHERE id = ?', (order_id,)).fetchone():
+                    return side
+            return None
+        except:
+            log_this(f'Something went wrong while getting the order {order_id} from the database!', level=ERROR)
+            return None
+
+    @timed('db.get_list_of_orders')
+    def get_list_of_orders(self, table):
+        """ Getting list of orders id from the table. """
+        try:
+            if table not in ORDERS_TABLES.values():
+                raise ValueError(table)
+            cur = self.connection().execute(f'SELECT id FROM {table}')
+            return [order_id for order_id, in cur.fetchall()]
+        except:
+            log_this('Something went wrong while getting list of orders from the database!', level=ERROR)
+            return []
+
+    @timed('db.insert_profit')
+    def insert_profit(self, total_balance, active_balance, time, symbol, profit,
+                      buy_order_id, sell_order_id, nolog_flag=False, hold_seconds=None):
+        """ Adding a new profit info into database. The daily, symbol and total roll-ups
+            are updated in the same transaction. """
+        try:
+            with self.transaction() as conn:
+                conn.execute('INSERT INTO profits (total_balance, active_balance, time, symbol, profit, '
+                             'buy_order_id, sell_order_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (total_balance, active_balance, time, symbol, profit, buy_order_id, sell_order_id))
+                is_trade = sell_order_id != 'None'
+                pnl = (profit, int(is_trade), int(is_trade and profit > 0),
+                       hold_seconds or 0, int(is_trade and hold_seconds is not None))
+                updates = ', '.join(f'{column} = {column} + excluded.{column}' for column in PNL_COLUMNS)
+                conn.execute(f'INSERT INTO daily_pnl (day, {", ".join(PNL_COLUMNS)}, total_balance, active_balance) '
+                             f'VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (day) DO UPDATE SET {updates}, '
+                             f'total_balance = excluded.total_balance, active_balance = excluded.active_balance',
+                             (time[:10],) + pnl + (total_balance, active_balance))
+                if is_trade:
+                    conn.execute(f'INSERT INTO symbol_pnl (symbol, {", ".join(PNL_COLUMNS)}) '
+                                 f'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (symbol) DO UPDATE SET {updates}',
+                                 (symbol,) + pnl)
+                    conn.execute(f'INSERT INTO pnl_totals (id, {", ".join(PNL_COLUMNS)}) '
+                                 f'VALUES (1, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET {updates}', pnl)
+                self._balances['total'], self._balances['active'] = total_balance, active_balance
+            if not nolog_flag:
+                log_this('Database: Profit $%s by %s has been inserted into the table.', profit, symbol, level=DEBUG)
+        except:
+            log_this(f'Something went wrong while inserting into the database! '
+                     f'({total_balance}, {active_balance}, {time}, {symbol}, '
+                     f'{profit}, {buy_order_id}, {sell_order_id})', level=ERROR)
+
+    def get_balance(self, prefix):
+        """ Getting current balance. """
+        try:
+            self.connection()
+            return self._balances[prefix]
+        except:
+            log_this(f'Something went wrong while getting {prefix}_balance from the database!', level=ERROR)
+            return 0
+
+    @timed('db.get_total_profit')
+    def get_total_profit(self):
+        """ Getting total profit. """
+        try:
+            row = self.connection().execute('SELECT profit FROM pnl_totals WHERE id = 1').fetchone()
+            return round(row[0], 2) if row else 0
+        except:
+            log_this('Something went wrong while getting total profit from the database!', level=ERROR)
+            return 0
+
+    @timed('db.get_todays_profit')
+    def get_todays_profit(self):
+        """ Getting today's profit. """
+        try:
+            today = str(datetime.date(datetime.utcnow()))
+            row = self.connection().execute('SELECT profit FROM daily_pnl WHERE day = ?', (today,)).fetchone()
+            return round(row[0], 2) if row else 0
+        except:
+            log_this('Something went wrong while getting total profit from the database!', level=ERROR)
+            return 0
+
+    def get_daily_pnl(self, days):
+        """ Getting the roll-ups of the last days with ledger entries, the latest first. """
+        try:
+            cur = self.connection().execute(f'SELECT day, {", ".join(PNL_COLUMNS)}, total_balance, active_balance '
+                                            f'FROM daily_pnl ORDER BY day DESC LIMIT ?', (days,))
+            return cur.fetchall()
+        except:
+            log_this('Something went wrong while getting daily profits from the database!', level=ERROR)
+            return []
+
+    def get_symbol_pnl(self, limit):
+        """ Getting the roll-ups of symbols, the most profitable first. """
+        try:
+            cur = self.connection().execute(f'SELECT symbol, {", ".join(PNL_COLUMNS)} FROM symbol_pnl '
+                                            f'ORDER BY profit DESC LIMIT ?', (limit,))
+            return cur.fetchall()
+        except:
+            log_this('Something went wrong while getting profits by symbol from the database!', level=ERROR)
+            return []
+
+    def get_pnl_totals(self):
+        """ Getting the roll-up of all trades. """
+        try:
+            row = self.connection().execute(f'SELECT {", ".join(PNL_COLUMNS)} FROM pnl_totals WHERE id = 1')
+            return row.fetchone() or (0, 0, 0, 0, 0)
+        except:
+            log_this('Something went wrong while getting total profits from the database!', level=ERROR)
+            return (0, 0, 0, 0, 0)
+
+    def get_symbol_count(self, symbol, table):
+        """ Getting count of orders with symbol from the table. """
+        try:
+            self.connection()
+            return self._symbol_counts[table][symbol]
+        except:
+            log_this(f'Something went wrong while count of orders with {symbol} from the database!', level=ERROR)
+            return 0
+
+    @timed('db.get_hourly_orders')
+    def get_hourly_orders(self, since):
+        """ Getting times of buy orders submitted since the time. """
+        try:
+            cur = self.connection().execute('SELECT time FROM hourly_orders WHERE time >= ? ORDER BY time', (since,))
+            return [time for time, in cur.fetchall()]
+        except:
+            log_this('Something went wrong while getting hourly orders from the database!', level=ERROR)
+            return []
+
+    @timed('db.insert_hourly_order')
+    def insert_hourly_order(self, order_id, time):
+        """ Adding a submitted buy order into the hourly window. """
+        try:
+            with self.transaction() as conn:
+                conn.execute('INSERT OR REPLACE INTO hourly_orders (id, time) VALUES (?, ?)', (order_id, time))
+        except:
+            log_this(f'Something went wrong while inserting into the database! ({order_id}, {time})', level=ERROR)
+
+    @timed('db.replace_hourly_orders')
+    def replace_hourly_orders(self, orders, since):
+        """ Replacing the hourly window with (order_id, time) pairs and dropping older records. """
+        try:
+            with self.transaction() as conn:
+                conn.execute('DELETE FROM hourly_orders WHERE time < ?', (since,))
+                conn.executemany('INSERT OR REPLACE INTO hourly_orders (id, time) VALUES (?, ?)', orders)
+        except:
+            log_this('Something went wrong while replacing hourly orders in the database!', level=ERROR)
+
+    @timed('db.get_meta')
+    def get_meta(self, key):
+        """ Getting a stored value by key. """
+        try:
+            row = self.connection().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+            return row[0] if row else None
+        except:
+            log_this(f'Something went wrong while getting {key} from the database!', level=ERROR)
+            return None
+
+    @timed('db.set_meta')
+    def set_meta(self, key, value):
+        """ Storing a value by key. """
+        try:
+            with self.transaction() as conn:
+                conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+        except:
+            log_this(f'Something went wrong while storing {key} into the database!', level=ERROR)
+
+    @timed('db.get_assets')
+    def get_assets(self):
+        """ Getting cached assets as symbol: (exchange, tradable, shortable, fractionable, status). """
+        try:
+            cur = self.connection().execute('SELECT symbol, exchange, tradable, shortable, fractionable, status '
+                                            'FROM assets')
+            return {symbol: tuple(attributes) for symbol, *attributes in cur.fetchall()}
+        except:
+            log_this('Something went wrong while getting assets from the database!', level=ERROR)
+            return {}
+
+    @timed('db.update_assets')
+    def update_assets(self, changed, removed, time):
+        """ Inserting or updating (symbol, exchange, tradable, shortable, fractionable, status) rows
+            and deleting removed symbols. """
+        try:
+            with self.transaction() as conn:
+                conn.executemany('INSERT OR REPLACE INTO assets (symbol, exchange, tradable, shortable, fractionable, '
+                                 'status, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 [tuple(row) + (time,) for row in changed])
+                conn.executemany('DELETE FROM assets WHERE symbol = ?', [(symbol,) for symbol in removed])
+        except:
+            log_this('Something went wrong while updating assets in the database!', level=ERROR)
+
+    def insert_run(self, started_at, duration, summary):
+        """ Adding a run summary into database. """
+        try:
+            with self.transaction() as conn:
+                conn.execute('INSERT INTO runs (started_at, duration, summary) VALUES (?, ?, ?)',
+                             (started_at, duration, summary))
+        except:
+            log_this(f'Something went wrong while inserting the run summary into the database! ({started_at})',
+                     level=ERROR)
+
+    @timed('db.insert_applied_intent')
+    def insert_applied_intent(self, client_order_id, order_id):
+        """ Marking an order intent as recorded. """
+        try:
+            with self.transaction() as conn:
+                conn.execute('INSERT OR REPLACE INTO applied_intents (client_order_id, order_id) VALUES (?, ?)',
+                             (client_order_id, order_id))
+        except:
+            log_this(f'Something went wrong while inserting into the database! ({client_order_id}, {order_id})',
+                     level=ERROR)
+
+    @timed('db.get_applied_intents')
+    def get_applied_intents(self, client_order_ids):
+        """ Getting those of the client order ids which intents are recorded (None if unknown). """
+        try:
+            conn = self.connection()
+            return {client_order_id for client_order_id in client_order_ids
+                    if conn.execute('SELECT 1 FROM applied_intents WHERE client_order_id = ?',
+                                    (client_order_id,)).fetchone()}
+        except:
+            log_this('Something went wrong while getting applied intents from the database!', level=ERROR)
+            return None
+
+
+db = Database(DATABASE_FILE)
+atexit.register(db.close)
+
+transaction = db.transaction
+insert_into_database = db.insert_into_database
+update_database = db.update_database
+delete_from_database = db.delete_from_database
+get_buy_order_id = db.get_buy_order_id
+get_order_side = db.get_order_side
+get_list_of_orders = db.get_list_of_orders
+insert_profit = db.insert_profit
+get_balance = db.get_balance
+get_total_profit = db.get_total_profit
+get_todays_profit = db.get_todays_profit
+get_daily_pnl = db.get_daily_pnl
+get_symbol_pnl = db.get_symbol_pnl
+get_pnl_totals = db.get_pnl_totals
+get_symbol_count = db.get_symbol_count
+get_hourly_orders = db.get_hourly_orders
+insert_hourly_order = db.insert_hourly_order
+replace_hourly_orders = db.replace_hourly_orders
+get_meta = db.get_meta
+set_meta = db.set_meta
+get_assets = db.get_assets
+update_assets = db.update_assets
+insert_run = db.insert_run
+after_commit = db.after_commit
+insert_applied_intent = db.insert_applied_intent
+get_applied_intents = db.get_applied_intents
@@ -0,0 +1,168 @@
+import json
+import time
+import random
+import itertools
+import threading
+import requests
+from collections import Counter
+from datetime import datetime, timedelta, time as day_time
+from alpaca_trade_api.entity import Asset, BarSet, Clock, Order
+from alpaca_trade_api.rest import APIError
+
+
+class FakeREST:
+    """ In-process fake of the tradeapi.REST methods used by the bot.
+        The universe is synthetic (or loaded from a recording), orders are kept in memory
+        and filled by advance(). Every call waits latency seconds and is counted in calls. """
+
+    def __init__(self, symbols_count=1000, latency=0.0, seed=0, recording=None):
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self.orders = dict()
+        self._ids = itertools.count(1)
+        if recording:
+            with open(recording, 'r') as recording_file:
+                recorded = json.load(recording_file)
+            self.assets = recorded['assets']
+            self.bars = recorded['bars']
+        else:
+            self.assets, self.bars = make_universe(symbols_count, seed)
+        self.prices = {symbol: bars[-1]['c'] for symbol, bars in self.bars.items() if bars}
+
+    def _call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_clock(self):
+        self._call('get_clock')
+        now = datetime.utcnow()
+        return Clock({'is_open': True, 'timestamp': now.isoformat() + 'Z',
+                      'next_open': (now + timedelta(days=1)).isoformat() + 'Z',
+                      'next_close': (now + timedelta(hours=6)).isoformat() + 'Z'})
+
+    def list_assets(self, status=None, asset_class=None):
+        self._call('list_assets')
+        return [Asset(asset) for asset in self.assets if status is None or asset['status'] == status]
+
+    def get_barset(self, symbols, timeframe, limit=None, start=None, end=None, after=None, until=None):
+        self._call('get_barset')
+        if isinstance(symbols, str):
+            symbols = symbols.split(',')
+        start_time = datetime.fromisoformat(start).timestamp() if start else None
+        raw = dict()
+        for symbol in symbols:
+            bars = self.bars.get(symbol, [])
+            if start_time is not None:
+                bars = [bar for bar in bars if bar['t'] >= start_time]
+            raw[symbol] = bars[-(limit or 100):]
+        return BarSet(raw)
+
+    def data_get(self, path, data=None, api_version='v1'):
+        self._call('data_get')
+        if path != '/stocks/snapshots':
+            raise api_error(404, 40410000, f'{path} is not faked')
+        return {symbol: {'prevDailyBar': self.bars[symbol][-2], 'dailyBar': self.bars[symbol][-1]}
+                for symbol in data['symbols'].split(',') if len(self.bars.get(symbol, [])) >= 2}
+
+    def submit_order(self, symbol, qty=None, side='buy', type='market', time_in_force='day', limit_price=None,
+                     client_order_id=None, **kwargs):
+        self._call('submit_order')
+        if symbol not in self.prices:
+            raise api_error(422, 40010001, f'asset {symbol} not found')
+        if client_order_id and any(order['client_order_id'] == client_order_id for order in self.orders.values()):
+            raise api_error(422, 40010001, 'client_order_id must be unique')
+        order_id = f'fake-{next(self._ids):08d}'
+        self.orders[order_id] = {'id': order_id, 'client_order_id': client_order_id or order_id,
+                                 'symbol': symbol, 'side': side, 'type': type, 'time_in_force': time_in_force,
+                                 'qty': str(qty), 'filled_qty': '0', 'filled_avg_price': None,
+                                 'limit_price': None if limit_price is None else str(limit_price),
+                                 'status': 'new', 'created_at': datetime.utcnow().isoformat() + 'Z'}
+        return Order(dict(self.orders[order_id]))
+
+    def get_order(self, order_id, nested=None):
+        self._call('get_order')
+        if order_id not in self.orders:
+            raise api_error(404, 40410000, 'order not found')
+        return Order(dict(self.orders[order_id]))
+
+    def get_order_by_client_order_id(self, client_order_id):
+        self._call('get_order_by_client_order_id')
+        for order in self.orders.values():
+            if order['client_order_id'] == client_order_id:
+                return Order(dict(order))
+        raise api_error(404, 40410000, 'order not found')
+
+    def list_orders(self, status=None, limit=None, after=None, until=None, direction=None, params=None,
+                    nested=None):
+        self._call('list_orders')
+        orders = sorted(self.orders.values(), key=lambda order: order['created_at'],
+                        reverse=(direction != 'asc'))
+        if after:
+            after = str(after).replace(' ', 'T')
+            orders = [order for order in orders if order['created_at'] > after]
+        if until:
+            orders = [order for order in orders if order['created_at'] < until]
+        if status in ('open', 'closed'):
+            is_open = (status == 'open')
+            orders = [order for order in orders if (order['status'] in ('new', 'partially_filled')) == is_open]
+        return [Order(dict(order)) for order in orders[:limit or 50]]
+
+    def cancel_order(self, order_id):
+        self._call('cancel_order')
+        if self.orders.get(order_id, {}).get('status') not in ('new', 'partially_filled'):
+            raise api_error(422, 42210000, 'order is not cancelable')
+        self.orders[order_id]['status'] = 'canceled'
+
+    def advance(self, minutes=0, fill_ratio=1.0, seed=0):
+        """ Ages all orders by minutes and fills the given share of open ones:
+            limit orders at their limit price, market orders at the last price. """
+        rnd = random.Random(seed)
+        for order in self.orders.values():
+            created_at = datetime.fromisoformat(order['created_at'][:-1]) - timedelta(minutes=minutes)
+            order['created_at'] = created_at.isoformat() + 'Z'
+            if order['status'] in ('new', 'partially_filled') and rnd.random() < fill_ratio:
+                order['status'] = 'filled'
+                order['filled_qty'] = order['qty']
+                order['filled_avg_price'] = order['limit_price'] or str(self.prices[order['symbol']])
+                order['filled_at'] = datetime.utcnow().isoformat() + 'Z'
+
+
+def api_error(status_code, code, message):
+    """ Makes an APIError like the REST client raises for an error response. """
+    response = requests.Response()
+    response.status_code = status_code
+    return APIError({'code': code, 'message': message}, requests.exceptions.HTTPError(response=response))
+
+
+def make_universe(symbols_count, seed=0):
+    """ Makes assets and yesterday's and today's daily bars of synthetic symbols.
+        About an eighth of them pass the screening checks with the default settings. """
+    rnd = random.Random(seed)
+    today = int(datetime.combine(datetime.utcnow().date(), day_time()).timestamp())
+    assets = list()
+    bars = dict()
+    for number in range(symbols_count):
+        symbol = f'S{number:05d}'
+        assets.append({'symbol': symbol, 'exchange': rnd.choice(('NYSE', 'NASDAQ', 'ARCA')), 'tradable': True,
+                       'shortable': rnd.random() < 0.7, 'fractionable': rnd.random() < 0.5, 'status': 'active',
+                       'class': 'us_equity'})
+        low = round(rnd.uniform(2, 200), 2)
+        close = round(low * rnd.uniform(1, 1.01), 2)
+        high = round(close * rnd.uniform(1, 1.04), 2)
+        volume = rnd.choice((1e4, 1e5, 1e6, 5e6))
+        bars[symbol] = [{'t': today - 86400, 'o': low, 'h': high, 'l': low, 'c': low, 'v': volume},
+                        {'t': today, 'o': low, 'h': high, 'l': low, 'c': close, 'v': volume}]
+    return assets, bars
+
+
+def record(api, symbols, path, limit=2):
+    """ Saves real assets and daily bars of the symbols to be replayed by FakeREST(recording=path). """
+    assets = [asset._raw for asset in api.list_assets(status='active')]
+    bars = dict()
+    for start in range(0, len(symbols), 200):
+        bars.update(api.get_barset(symbols[start:start + 200], 'day', limit=limit)._raw)
+    with open(path, 'w') as recording_file:
+        json.dump({'assets': assets, 'bars': bars}, recording_file)
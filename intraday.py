@@ -0,0 +1,189 @@
+import asyncio
+import queue
+import threading
+import numpy as np
+import pandas as pd
+import alpaca_trade_api as tradeapi
+from alpaca_trade_api.stream import Stream
+
+from config import parameters
+from logs import log_this, DEBUG, ERROR
+from market_data import bar_store, split_into_chunks, log_api_error, EXCHANGE_TIMEZONE
+from screening import check_bars
+from metrics import count
+
+
+SESSION_OPEN = pd.Timedelta(hours=9, minutes=30)
+
+
+class MinuteWindows:
+    """ Minute bars of the watched symbols. The last window bars of every symbol are kept in preallocated
+        ring buffers, so the session low / high / volume / VWAP and the window volume / VWAP
+        are updated in O(1) per bar: the new bar is added and the evicted one is subtracted. """
+
+    def __init__(self, symbols, window, yesterday_volumes):
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.window = window
+        size = len(self.symbols)
+        self._volumes = np.zeros((size, window))
+        self._amounts = np.zeros((size, window))
+        self._positions = np.zeros(size, dtype=np.int64)
+        self.last_times = np.zeros(size, dtype=np.int64)
+        self.yesterday_volume = np.array([yesterday_volumes.get(symbol, 0.0) for symbol in self.symbols],
+                                         dtype=np.float64)
+        self.low = np.full(size, np.inf)
+        self.high = np.full(size, -np.inf)
+        self.close = np.full(size, np.nan)
+        self.volume = np.zeros(size)
+        self.amount = np.zeros(size)
+        self.window_volume = np.zeros(size)
+        self.window_amount = np.zeros(size)
+
+    def add(self, symbol, time, high, low, close, volume):
+        """ Adds a bar and returns the index of its symbol, or None if the symbol isn't watched
+            or the bar is not newer than the last one (the stream and the requests may overlap). """
+        i = self.index.get(symbol)
+        if i is None or time <= self.last_times[i]:
+            return None
+        amount = (high + low + close) / 3 * volume
+        position = self._positions[i] % self.window
+        self.window_volume[i] += volume - self._volumes[i, position]
+        self.window_amount[i] += amount - self._amounts[i, position]
+        self._volumes[i, position] = volume
+        self._amounts[i, position] = amount
+        self._positions[i] += 1
+        if low < self.low[i]:
+            self.low[i] = low
+        if high > self.high[i]:
+            self.high[i] = high
+        self.close[i] = close
+        self.volume[i] += volume
+        self.amount[i] += amount
+        self.last_times[i] = time
+        return i
+
+    def vwap(self):
+        """ Session VWAP of every symbol. """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.amount / self.volume
+
+    def window_vwap(self):
+        """ VWAP of the last window bars of every symbol. """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.window_amount / self.window_volume
+
+    def check(self, indexes, settings=parameters):
+        """ Applies the volume, current-lowest gap and target checks to the given symbols.
+            Returns passed symbols like screening.screen does. """
+        indexes = np.fromiter(indexes, dtype=np.int64)
+        indexes = indexes[~np.isnan(self.close[indexes])]
+        close = self.close[indexes]
+        passed, target_price, gap, volume = check_bars(self.yesterday_volume[indexes], self.volume[indexes],
+                                                       self.low[indexes], self.high[indexes], close, settings)
+        result = pd.DataFrame({'symbol': np.array(self.symbols, dtype=object)[indexes][passed],
+                               'price': close[passed],
+                               'target_price': target_price[passed],
+                               'gap': gap[passed],
+                               'volume': volume[passed],
+                               'vwap': self.vwap()[indexes][passed]})
+        return result.sort_values(['gap', 'volume'], ascending=[True, False], kind='stable').reset_index(drop=True)
+
+
+class IntradayMonitor:
+    """ Watches minute bars of the shortlisted symbols and checks them on every new bar.
+        Bars come from the market data stream (listened to in a background thread)
+        or, while the stream is down, from requests every poll interval. """
+
+    def __init__(self, api_key, api_secret, base_url, feed, window, poll_interval):
+        self.window = window
+        self.poll_interval = poll_interval
+        self.windows = MinuteWindows([], window, dict())
+        self.session_start = 0
+        self._bars = queue.Queue()
+        self._updated = set()
+        self._stream = Stream(api_key, api_secret, base_url, data_feed=feed)
+        # All symbols are subscribed, so the watched ones are changed without resubscribing
+        self._stream.subscribe_bars(self._on_bar, '*')
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """ Starts listening. """
+        self._thread.start()
+
+    def is_alive(self):
+        """ Checks whether the stream is still listened to. """
+        return self._thread.is_alive()
+
+    def watch(self, api, symbols):
+        """ Starts watching the symbols: builds their windows from today's minute bars. """
+        session_start = pd.Timestamp.now(tz=EXCHANGE_TIMEZONE).normalize() + SESSION_OPEN
+        self.session_start = int(session_start.timestamp())
+        windows = MinuteWindows(symbols, self.window, get_yesterday_volumes(symbols, self.session_start))
+        for chunk in split_into_chunks(symbols, parameters.getint('bars request size')):
+            try:
+                barset = api.get_barset(chunk, 'minute', start=session_start.isoformat(), limit=1000)
+            except tradeapi.rest.APIError as apierror:
+                log_api_error(chunk, apierror)
+                continue
+            for symbol, bars in barset._raw.items():
+                for bar in bars:
+                    if bar['t'] >= self.session_start:
+                        windows.add(symbol, bar['t'], bar['h'], bar['l'], bar['c'], bar['v'])
+        self.windows = windows
+        self._updated = set(range(len(symbols)))
+        log_this('%s symbols are watched by minute bars.', len(symbols), level=DEBUG)
+
+    def poll(self, api):
+        """ Requests minute bars newer than the last ones. """
+        symbols = self.windows.symbols
+        for chunk in split_into_chunks(symbols, parameters.getint('bars request size')):
+            after = max(int(self.windows.last_times[[self.windows.index[symbol] for symbol in chunk]].min()),
+                        self.session_start - 60)
+            after_time = pd.Timestamp(after, unit='s', tz='UTC').tz_convert(EXCHANGE_TIMEZONE)
+            try:
+                barset = api.get_barset(chunk, 'minute', after=after_time.isoformat(), limit=1000)
+            except tradeapi.rest.APIError as apierror:
+                log_api_error(chunk, apierror)
+                continue
+            for symbol, bars in barset._raw.items():
+                for bar in bars:
+                    self._add(symbol, bar['t'], bar['h'], bar['l'], bar['c'], bar['v'])
+
+    def candidates(self, settings=parameters):
+        """ Adds the streamed bars and checks the symbols which have got new bars since the last call. """
+        try:
+            while True:
+                self._add(*self._bars.get_nowait())
+        except queue.Empty:
+            pass
+        updated, self._updated = self._updated, set()
+        return self.windows.check(updated, settings)
+
+    def _add(self, symbol, time, high, low, close, volume):
+        if time < self.session_start:
+            return
+        i = self.windows.add(symbol, time, high, low, close, volume)
+        if i is not None:
+            self._updated.add(i)
+            count('minute_bars')
+
+    def _run(self):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        try:
+            self._stream.run()
+        except Exception as error:
+            log_this(f'Minute bars stream is stopped! ({error!r})', level=ERROR)
+
+    async def _on_bar(self, bar):
+        self._bars.put((bar.symbol, bar.timestamp // 10**9, bar.high, bar.low, bar.close, bar.volume))
+
+
+def get_yesterday_volumes(symbols, session_start):
+    """ Getting the volume of the last stored daily bar before today of every symbol. """
+    volumes = dict()
+    for symbol, bars in bar_store.get_daily_bars(symbols):
+        previous = [bar for bar in bars if bar['t'] < session_start - SESSION_OPEN.total_seconds()]
+        if previous:
+            volumes[symbol] = previous[-1]['v']
+    return volumes
@@ -0,0 +1,81 @@
+import sqlite3
+import atexit
+from collections import namedtuple
+from datetime import datetime
+
+from logs import log_this, ERROR
+
+
+JOURNAL_FILE = 'journal.db'
+OPEN = 'open'
+APPLIED = 'applied'
+FAILED = 'failed'
+
+Intent = namedtuple('Intent', 'client_order_id symbol side type qty limit_price buy_order_id created_at status')
+
+
+class Journal:
+    """ Write-ahead log of order intents. An intent is made durable before the order is submitted
+        and closed once the order is recorded in data.db (or has failed). It lives in its own file,
+        so it is committed at once even while data.db is inside a transaction. """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    def connection(self):
+        """ Opens the connection on first use. """
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=FULL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS "intents" ("client_order_id"	TEXT NOT NULL UNIQUE,
+                                                                       "symbol"	TEXT NOT NULL,
+                                                                       "side"	TEXT NOT NULL,
+                                                                       "type"	TEXT NOT NULL,
+                                                                       "qty"	REAL,
+                                                                       "limit_price"	REAL,
+                                                                       "buy_order_id"	TEXT,
+                                                                       "created_at"	TEXT NOT NULL,
+                                                                       "status"	TEXT NOT NULL,
+                                                                       PRIMARY KEY("client_order_id")
+                                                                       )''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS "intents_status" ON "intents" ("status")')
+        return self._conn
+
+    def close(self):
+        """ Closes the connection. """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def open_intent(self, client_order_id, symbol, side, order_type, qty, limit_price=None, buy_order_id=None):
+        """ Writes an intent before its order is submitted. """
+        self.connection().execute('INSERT OR REPLACE INTO intents (client_order_id, symbol, side, type, qty, '
+                                  'limit_price, buy_order_id, created_at, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                  (client_order_id, symbol, side, order_type, float(qty),
+                                   None if limit_price is None else float(limit_price), buy_order_id,
+                                   datetime.utcnow().isoformat(), OPEN))
+
+    def close_intent(self, client_order_id, status):
+        """ Marks an intent as applied or failed. An intent left open is closed by the recovery. """
+        try:
+            self.connection().execute('UPDATE intents SET status = ? WHERE client_order_id = ?',
+                                      (status, client_order_id))
+        except:
+            log_this(f'Something went wrong while closing the intent {client_order_id} in the journal!', level=ERROR)
+
+    def get_intent(self, client_order_id):
+        """ Getting an intent by the client order id or None. """
+        row = self.connection().execute('SELECT * FROM intents WHERE client_order_id = ?',
+                                        (client_order_id,)).fetchone()
+        return Intent(*row) if row else None
+
+    def get_open_intents(self):
+        """ Getting intents which orders may be unrecorded, the oldest first. """
+        cur = self.connection().execute('SELECT * FROM intents WHERE status = ? ORDER BY created_at', (OPEN,))
+        return [Intent(*row) for row in cur.fetchall()]
+
+
+journal = Journal(JOURNAL_FILE)
+atexit.register(journal.close)
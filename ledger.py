@@ -0,0 +1,51 @@
+import argparse
+from datetime import date, timedelta
+
+from database import get_daily_pnl, get_symbol_pnl, get_pnl_totals
+
+
+def weekly_pnl(daily):
+    """ Sums daily roll-ups (the latest first) into ISO weeks, the latest first. """
+    weeks = dict()
+    for day, *pnl, total_balance, active_balance in daily:
+        year, week, _ = date.fromisoformat(day).isocalendar()
+        key = f'{year}-W{week:02d}'
+        if key in weeks:
+            weeks[key] = [total + value for total, value in zip(weeks[key], pnl)]
+        else:
+            weeks[key] = list(pnl)
+    return [(key, *pnl) for key, pnl in weeks.items()]
+
+
+def format_pnl(profit, trades, wins, hold_seconds, held_trades):
+    """ Formats profit, trades, win rate and average hold time. """
+    win_rate = f'{wins / trades:.0%}' if trades else '-'
+    hold = str(timedelta(seconds=round(hold_seconds / held_trades))) if held_trades else '-'
+    return f'{profit:>12.2f} {trades:>7} {win_rate:>8} {hold:>14}'
+
+
+def print_report(title, rows):
+    """ Prints roll-ups with the title of their key column. """
+    print(f'{title:<12} {"profit":>12} {"trades":>7} {"win rate":>8} {"average hold":>14}')
+    for key, *pnl in rows:
+        print(f'{key:<12} {format_pnl(*pnl)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reports profits from the ledger roll-ups.')
+    parser.add_argument('--daily', type=int, metavar='DAYS', help='profits of the last DAYS trading days')
+    parser.add_argument('--weekly', type=int, metavar='WEEKS', help='profits of the last WEEKS weeks')
+    parser.add_argument('--symbols', type=int, metavar='COUNT', help='COUNT most profitable symbols')
+    args = parser.parse_args()
+    if args.daily:
+        print_report('day', [row[:-2] for row in get_daily_pnl(args.daily)])
+        print()
+    if args.weekly:
+        # A week has at most 7 days with entries, so the last WEEKS weeks are within WEEKS * 7 days
+        weeks = weekly_pnl(get_daily_pnl(args.weekly * 7))
+        print_report('week', weeks[:args.weekly])
+        print()
+    if args.symbols:
+        print_report('symbol', get_symbol_pnl(args.symbols))
+        print()
+    print_report('total', [('all',) + tuple(get_pnl_totals())])
@@ -0,0 +1,114 @@
+import alpaca_trade_api as tradeapi
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from config import parameters
+from database import get_hourly_orders, insert_hourly_order, replace_hourly_orders, get_meta, set_meta
+from logs import log_this, ERROR
+
+
+class HourlyLimiter:
+    """ Sliding one-hour window of submitted buy orders.
+        It is synced with API at most once per window and counted locally in between.
+        Worker processes of one profile count their orders in a shared window (see share). """
+
+    def __init__(self, limit, window=timedelta(hours=1)):
+        self.limit = limit
+        self.window = window
+        self._times = deque()
+        self._blocked = False
+        self._shared = None
+        # Slots of the shared window reserved by queued buy orders: client_order_id: slot
+        self._reserved = dict()
+
+    def share(self, times, lock):
+        """ Counts orders in a window shared by processes: a multiprocessing array of limit timestamps
+            (0 for a free slot). It is filled by the first process that seeds it and kept by reservations
+            and registrations. """
+        self._shared = (times, lock)
+
+    def seed(self, api):
+        """ Loads the window from the database, or from API if the stored one is out of date. """
+        now = datetime.utcnow()
+        since = str(now - self.window)[:19]
+        synced_at = get_meta('hourly orders synced at')
+        if synced_at is None or synced_at < since:
+            try:
+                orders = api.list_orders(after=(now - self.window), limit=500, status='all')
+            except tradeapi.rest.APIError as apierror:
+                log_this('Something went wrong with API while checking hourly limitation!', level=ERROR)
+                log_this(str(apierror), notime_flag=True, level=ERROR)
+                self._blocked = True
+                return
+            replace_hourly_orders([(order.id, order._raw['created_at'][:19].replace('T', ' '))
+                                   for order in orders if order.side == 'buy'], since)
+            set_meta('hourly orders synced at', str(now)[:19])
+        self._blocked = False
+        self._times = deque(get_hourly_orders(since))
+        if self._shared:
+            times, lock = self._shared
+            with lock:
+                if len(times) and not any(times):
+                    for i, time in enumerate(list(self._times)[-len(times):]):
+                        times[i] = to_timestamp(time)
+
+    def reserve(self, client_order_id):
+        """ Takes a slot of the shared window for a buy order being queued. The processes queue orders
+            without waiting for each other, so the slot is taken at once, and False is returned if the window
+            is full. Without a shared window queued orders are counted by is_reached, so it is always True. """
+        if not self._shared:
+            return True
+        times, lock = self._shared
+        now = datetime.utcnow()
+        since_time = to_timestamp(str(now - self.window)[:19])
+        with lock:
+            slot = min(range(len(times)), key=times.__getitem__, default=None)
+            if slot is None or times[slot] >= since_time:
+                return False
+            times[slot] = to_timestamp(str(now)[:19])
+        self._reserved[client_order_id] = slot
+        return True
+
+    def release(self, client_order_id):
+        """ Frees the slot reserved for a buy order which hasn't been submitted. """
+        slot = self._reserved.pop(client_order_id, None)
+        if slot is not None:
+            times, lock = self._shared
+            with lock:
+                times[slot] = 0
+
+    def register(self, order_id, client_order_id=None):
+        """ Counts a submitted buy order in the slot reserved for it (or in the oldest one). """
+        time_now = str(datetime.utcnow())[:19]
+        self._times.append(time_now)
+        insert_hourly_order(order_id, time_now)
+        if self._shared:
+            times, lock = self._shared
+            with lock:
+                slot = self._reserved.pop(client_order_id, None)
+                if slot is None:
+                    slot = min(range(len(times)), key=times.__getitem__, default=None)
+                if slot is not None:
+                    times[slot] = to_timestamp(time_now)
+
+    def is_reached(self, queued=0):
+        """ Checks hourly limitation of buy orders, counting queued ones too
+            (in a shared window they have reserved their slots already). """
+        since = str(datetime.utcnow() - self.window)[:19]
+        while self._times and self._times[0] < since:
+            self._times.popleft()
+        if self._shared:
+            times, lock = self._shared
+            since_time = to_timestamp(since)
+            with lock:
+                submitted = sum(1 for time in times if time >= since_time)
+            return self._blocked or submitted >= self.limit
+        return self._blocked or len(self._times) + queued >= self.limit
+
+
+def to_timestamp(time):
+    """ Converts a UTC time string of the database into a POSIX timestamp. """
+    return datetime.fromisoformat(time).replace(tzinfo=timezone.utc).timestamp()
+
+
+hourly_limiter = HourlyLimiter(parameters.getint('hourly limitation'))
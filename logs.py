@@ -1,16 +1,117 @@
 import os
+import sys
+import queue
+import atexit
+import threading
 from datetime import datetime
 
 from config import parameters
+from metrics import span, count
 
 
-def log_this(log_string, notime_flag=False):
-    """ Simple logging to a text file / screen. """
-    if parameters.getboolean('log to file'):
-        if not os.path.exists('logs/'):
-            os.mkdir('logs/')
-        log = open(f'logs/{datetime.date(datetime.utcnow())}.log', 'a')
-        log.write(f'\n{log_string}\n\n' if notime_flag else f'{str(datetime.utcnow())[:19]} | {log_string}\n')
-        log.close()
-    if parameters.getboolean('log to screen'):
-        print(f'\n{log_string}\n\n' if notime_flag else f'{str(datetime.utcnow())[:19]} | {log_string}\n')
+DEBUG = 10
+INFO = 20
+ERROR = 40
+LEVELS = {'debug': DEBUG, 'info': INFO, 'error': ERROR}
+LOGS_DIR = 'logs/'
+
+
+class Logger:
+    """ Logging to a text file / screen. Records are written to the daily file
+        by a background thread in batches. """
+
+    def __init__(self, level, to_file, to_screen):
+        self.level = level
+        self.to_file = to_file
+        self.to_screen = to_screen
+        self._queue = queue.Queue()
+        self._thread = None
+        self._file = None
+        self._file_date = None
+
+    def configure(self, settings):
+        """ Sets the level and the outputs from the settings. """
+        self.level = LEVELS[settings.get('log level')]
+        self.to_file = settings.getboolean('log to file')
+        self.to_screen = settings.getboolean('log to screen')
+
+    def log(self, log_string, *args, notime_flag=False, level=INFO):
+        """ Simple logging to a text file / screen. If args are given, the string is %-formatted with them
+            only when the record passes the level, so frequent debug records should pass their values this way
+            (an f-string is built by the caller anyway). """
+        if level < self.level:
+            return
+        if args:
+            log_string = log_string % args
+        now = datetime.utcnow()
+        record = f'\n{log_string}\n\n' if notime_flag else f'{str(now)[:19]} | {log_string}\n'
+        if self.to_file:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write, daemon=True)
+                self._thread.start()
+            self._queue.put((datetime.date(now), record))
+        if self.to_screen:
+            print(record)
+
+    def flush(self):
+        """ Writes all queued records and stops the writer. """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _write(self):
+        while True:
+            batch = [self._queue.get()]
+            while batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with span('log.write'):
+                    for item in batch:
+                        if item is None:
+                            break
+                        date, record = item
+                        if date != self._file_date:
+                            self._open(date)
+                        self._file.write(record)
+                        count('log_records')
+                    if self._file is not None:
+                        self._file.flush()
+            except OSError as error:
+                self._stop_writing(error)
+                return
+            if batch[-1] is None:
+                if self._file is not None:
+                    self._file.close()
+                self._file = self._file_date = None
+                return
+
+    def _stop_writing(self, error):
+        # Records are no longer queued for the file and the queued ones are dropped, so the queue doesn't grow
+        self.to_file = False
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+        self._file = self._file_date = None
+        print(f'Logging to file is stopped and the queued records are dropped! ({error!r})', file=sys.stderr)
+
+    def _open(self, date):
+        if self._file is not None:
+            self._file.close()
+        if not os.path.exists(LOGS_DIR):
+            os.mkdir(LOGS_DIR)
+        self._file = open(f'{LOGS_DIR}{date}.log', 'a')
+        self._file_date = date
+
+
+logger = Logger(LEVELS[parameters.get('log level')],
+                parameters.getboolean('log to file'), parameters.getboolean('log to screen'))
+atexit.register(logger.flush)
+log_this = logger.log
@@ -1,121 +1,237 @@
-import os
+import json
+import time
+import argparse
+from contextlib import nullcontext
 import alpaca_trade_api as tradeapi
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from config import parameters, api_keys
-from logs import log_this
-from orders import make_limit_buy_order
-from orders_checks import check_orders
-from database import get_balance, insert_profit, get_symbol_count
+from logs import log_this, DEBUG, ERROR
+from orders import make_limit_buy_order, apply_buy_orders, get_pending_amount, pending_buys
+from orders_checks import check_orders, check_order_update, recover_orders
+from market_data import bar_store, get_two_day_volumes
+from assets import get_universe
+from screening import bars_to_frame, screen, shortlist
+from limits import hourly_limiter
+from trade_updates import TradeUpdates
+from intraday import IntradayMonitor
+from database import get_balance, get_symbol_count, get_todays_profit, insert_run
+from metrics import metrics, span, count, profile, InstrumentedREST
 
 
 API_KEY = api_keys.get('api key')
 API_SECRET = api_keys.get('api secret')
 APCA_API_BASE_URL = 'https://{}api.alpaca.markets'.format('paper-' if parameters.getboolean('sandbox mode') else '')
 SYMBOLS_FILE = 'symbols.txt'
+# seconds, the longest wait after repeated errors in daemon mode
+MAX_ERROR_DELAY = 300
 
 
 def run():
     """ Main function. """
     log_this('Script is running', notime_flag=True)
+    metrics.reset()
     try:
-        api = tradeapi.REST(API_KEY, API_SECRET, APCA_API_BASE_URL, api_version='v2')
+        api = InstrumentedREST(tradeapi.REST(API_KEY, API_SECRET, APCA_API_BASE_URL, api_version='v2'), metrics)
         clock = api.get_clock()
     except tradeapi.rest.APIError as apierror:
-        log_this('Something went wrong with API while connecting!')
-        log_this(str(apierror), notime_flag=True)
+        log_this('Something went wrong with API while connecting!', level=ERROR)
+        log_this(str(apierror), notime_flag=True, level=ERROR)
     else:
+        recover_orders(api)
         if not clock.is_open:
             log_this('The market is closed.')
         else:
             log_this('The market is open.')
-            check_symbols_file(api)
-            with open(SYMBOLS_FILE, 'r') as symbols:
-                for line in symbols.readlines():
-                    if is_hourly_limitation_not_ok(api):
-                        log_this('Hourly limitation ({}) is reached.'.format(parameters.getint('hourly limitation')))
-                        break
-                    symbol = line[:-1]
-                    if is_symbolic_limitation_ok(symbol):
-                        log_this(f'Checking {symbol}...')
-                        is_it_good, price = currency_checking(api, symbol)
-                        if is_it_good:
-                            log_this(f'{symbol} has passed all checks.')
-                            buy_it(api, symbol, price)
-                        else:
-                            log_this(f'{symbol} hasn\'t passed all checks.')
-            check_orders(api)
+            with span('phase.scan'):
+                scan(api)
+            with span('phase.check_orders'):
+                check_orders(api)
+            save_metrics()
+
+
+def run_daemon(shard=(0, 1), report=None, streams=True):
+    """ Keeps one API session and runs scans and order checks while the market is open.
+        Only symbols of the shard (index, count) are scanned. If report is set, it is called
+        with the status after every scan. If not streams, the trade updates and minute bars streams
+        are not opened: orders are checked every check interval and minute bars are requested. """
+    log_this('Script is running in daemon mode', notime_flag=True)
+    api = InstrumentedREST(tradeapi.REST(API_KEY, API_SECRET, APCA_API_BASE_URL, api_version='v2'), metrics)
+    scan_interval = parameters.getfloat('scan interval') * 60
+    check_interval = parameters.getfloat('orders check interval')
+    trade_updates = None
+    if streams and parameters.getboolean('trade updates stream'):
+        trade_updates = TradeUpdates(API_KEY, API_SECRET, APCA_API_BASE_URL)
+        trade_updates.start()
+    intraday = None
+    if parameters.getboolean('intraday mode'):
+        intraday = IntradayMonitor(API_KEY, API_SECRET, APCA_API_BASE_URL, parameters.get('intraday feed'),
+                                   parameters.getint('intraday window'), parameters.getfloat('intraday poll interval'))
+        if streams:
+            intraday.start()
+    market_close = next_scan = next_check = next_poll = 0
+    errors = 0
+    is_recovered = False
+    try:
+        while True:
+            if not is_recovered:
+                try:
+                    recover_orders(api)
+                    is_recovered = True
+                except Exception as error:
+                    errors += 1
+                    wait_after_error('Something went wrong while recovering orders!', error, errors, check_interval)
+                    continue
+            if time.time() >= market_close:
+                try:
+                    clock = api.get_clock()
+                except Exception as error:
+                    errors += 1
+                    wait_after_error('Something went wrong with API while getting the market clock!', error, errors,
+                                     check_interval)
+                    continue
+                if not clock.is_open:
+                    log_this(f'The market is closed. Waiting for the opening at {clock.next_open}.')
+                    time.sleep(max((clock.next_open - clock.timestamp).total_seconds(), check_interval))
+                    continue
+                log_this(f'The market is open until {clock.next_close}.')
+                market_close = time.time() + (clock.next_close - clock.timestamp).total_seconds()
+            try:
+                if time.time() >= next_scan:
+                    if next_scan:
+                        save_metrics()
+                    metrics.reset()
+                    next_scan = time.time() + scan_interval
+                    with span('phase.scan'):
+                        symbols = scan(api, shard)
+                    if report:
+                        report(get_status())
+                    if intraday:
+                        with span('phase.intraday_watch'):
+                            intraday.watch(api, symbols)
+                if time.time() >= next_check:
+                    if trade_updates and trade_updates.is_alive():
+                        next_check = time.time() + parameters.getfloat('orders reconciliation interval') * 60
+                    else:
+                        next_check = time.time() + check_interval
+                    with span('phase.check_orders'):
+                        check_orders(api)
+                if intraday:
+                    if not intraday.is_alive() and time.time() >= next_poll:
+                        next_poll = time.time() + intraday.poll_interval
+                        with span('phase.intraday_poll'):
+                            intraday.poll(api)
+                    with span('phase.intraday'):
+                        buy_intraday_candidates(api, intraday.candidates())
+                errors = 0
+            except Exception as error:
+                errors += 1
+                wait_after_error('Something went wrong during the cycle!', error, errors, check_interval)
+                continue
+            timeout = max(min(next_scan, next_check, market_close) - time.time(), 0)
+            if intraday:
+                # Streamed bars are checked at least every second
+                timeout = min(timeout, 1 if intraday.is_alive() else max(next_poll - time.time(), 0))
+            if trade_updates and trade_updates.is_alive():
+                for event, order in trade_updates.wait(timeout):
+                    try:
+                        with span('phase.trade_update'):
+                            check_order_update(api, event, order)
+                    except Exception as error:
+                        log_this(f'Something went wrong while handling a trade update! ({error!r})', level=ERROR)
+            else:
+                time.sleep(timeout)
+    except KeyboardInterrupt:
+        save_metrics()
+        log_this('Script is stopped.')
+
+
+def wait_after_error(message, error, errors, check_interval):
+    """ Logs an error of the daemon cycle and waits longer after each of the repeated ones. """
+    log_this(message, level=ERROR)
+    log_this(repr(error), notime_flag=True, level=ERROR)
+    time.sleep(min(check_interval * 2 ** (errors - 1), MAX_ERROR_DELAY))
+
+
+def scan(api, shard=(0, 1)):
+    """ Checks all symbols of the shard (index, count) and buys those which have passed the checks.
+        Returns the checked symbols. """
+    with span('phase.universe'):
+        symbols = [symbol for symbol in get_universe(api, SYMBOLS_FILE, shard)
+                   if is_symbolic_limitation_ok(symbol)]
+    count('symbols_in_universe', len(symbols))
+    if parameters.getboolean('snapshot pre-filter'):
+        universe_size = len(symbols)
+        with span('phase.pre_filter'):
+            volumes, unchecked = get_two_day_volumes(api, symbols)
+            # Symbols without snapshots and stored bars are passed through, so their bars get stored
+            symbols = shortlist(volumes, parameters.getint('shortlist size')) + unchecked
+        log_this('%s of %s symbols are shortlisted by volume, %s of them unchecked.', len(symbols), universe_size,
+                 len(unchecked), level=DEBUG)
+    with span('phase.bars'):
+        bar_store.refresh(api, symbols)
+    with span('phase.screening'):
+        candidates = screen(bars_to_frame(bar_store.get_daily_bars(symbols)))
+    count('symbols_scanned', len(symbols))
+    count('candidates', len(candidates))
+    log_this(f'{len(candidates)} of {len(symbols)} symbols have passed all checks.')
+    with span('phase.buying'):
+        hourly_limiter.seed(api)
+        buy_candidates(api, candidates)
+    return symbols
+
+
+def buy_intraday_candidates(api, candidates):
+    """ Buys symbols which have passed the checks on a minute bar and haven't been bought yet. """
+    queued = {symbol for symbol, _, _, _ in pending_buys.values()}
+    candidates = candidates.loc[[symbol not in queued and is_symbolic_limitation_ok(symbol)
+                             for symbol in candidates['symbol']]]
+    if len(candidates):
+        count('intraday_candidates', len(candidates))
+        buy_candidates(api, candidates)
+
+
+def buy_candidates(api, candidates):
+    """ Buys candidates in their order until the hourly limitation is reached. """
+    for candidate in candidates.itertuples():
+        apply_buy_orders(api)
+        if hourly_limiter.is_reached(len(pending_buys)):
+            log_this('Hourly limitation ({}) is reached.'.format(parameters.getint('hourly limitation')))
+            break
+        log_this(f'{candidate.symbol} has passed all checks. Price: ${candidate.price}, '
+                 f'target: ${candidate.target_price}.')
+        buy_it(api, candidate.symbol, float(candidate.price))
+    apply_buy_orders(api, wait=True)
 
 
 def buy_it(api, symbol, price):
-    """ Buys currency if enough money. """
-    total_balance = get_balance('total')
-    active_balance = get_balance('active')
+    """ Buys currency if enough money. The money of queued orders isn't counted. """
+    active_balance = get_balance('active') - get_pending_amount()
     if active_balance > price:
-        log_this(f'Making Limit Buy-Order...')
-        quantity = (min(active_balance, parameters.getfloat('maximal order volume')) / price) // 1
+        log_this('Making Limit Buy-Order...', level=DEBUG)
+        quantity = order_quantity(active_balance, price)
         make_limit_buy_order(api, symbol, quantity, price)
-        total_balance -= quantity * price
-        active_balance -= quantity * price
-        time_now = str(datetime.utcnow())[:19]
-        insert_profit(total_balance, active_balance, time_now,
-                      symbol, 0, 'None', 'None', nolog_flag=True)
     else:
         log_this('But not enough money.')
 
 
-def currency_checking(api, symbol):
-    """ Checks the currency for compliance with the conditions. """
-    try:
-        barset = api.get_barset(symbol, 'day', limit=2)
-    except tradeapi.rest.APIError as apierror:
-        log_this(f'Something went wrong with API while getting bars for {symbol}!')
-        log_this(str(apierror), notime_flag=True)
-        return False, 0
-    else:
-        try:
-            yesterday_bar = barset[symbol][0]
-            today_bar = barset[symbol][1]
-        except IndexError:
-            return False, 0
-        else:
-            if datetime.date(datetime.fromtimestamp(today_bar._raw['t'])) != datetime.date(datetime.utcnow()):
-                return False, 0
-            log_this(barset.df, notime_flag=True)
-            if yesterday_bar.v + today_bar.v < 2 * parameters.getfloat('least trade volume'):
-                log_this(f'{symbol} has not enough volume.')
-            else:
-                log_this(f'{symbol} has enough volume.')
-                if today_bar.c / today_bar.l > parameters.getfloat('current-lowest gap'):
-                    log_this(f'But {symbol} has not the lowest point for today.')
-                else:
-                    log_this(f'{symbol} has the lowest point for today.')
-                    current_price = today_bar.c
-                    target_percent = 1 + parameters.getfloat('check target percent')/100
-                    target_price = round(current_price * target_percent, 2)
-                    if not today_bar.l <= target_price <= today_bar.h:
-                        log_this(f'But target ${target_price} hasn\'t been hit today.')
-                    else:
-                        log_this(f'And target ${target_price} has been hit today.')
-                        return True, current_price
-            return False, 0
+def get_status():
+    """ Getting the balances, today's profit and the counters of the current run. """
+    return {'total_balance': get_balance('total'), 'active_balance': get_balance('active'),
+            'todays_profit': get_todays_profit(), 'counters': metrics.summary()['counters']}
 
 
-def is_hourly_limitation_not_ok(api):
-    """ Checks hourly limitation of buy orders. """
-    count = 0
-    now = datetime.utcnow()
-    try:
-        orders = api.list_orders(after=(now - timedelta(hours=1)), limit=500, status='all')
-    except tradeapi.rest.APIError as apierror:
-        log_this('Something went wrong with API while checking hourly limitation!')
-        log_this(str(apierror), notime_flag=True)
-        return True
-    else:
-        for order in orders:
-            if order.side == 'buy':
-                count += 1
-    return False if count < parameters.getint('hourly limitation') else True
+def save_metrics():
+    """ Writes the run summary into the database and exports Prometheus metrics if the file is set. """
+    summary = metrics.summary()
+    insert_run(str(datetime.utcfromtimestamp(metrics.started_at))[:19], summary['duration'], json.dumps(summary))
+    if parameters.get('metrics file'):
+        metrics.export(parameters.get('metrics file'))
+
+
+def order_quantity(active_balance, price, settings=parameters):
+    """ Calculates the quantity of a buy order. """
+    return (min(active_balance, settings.getfloat('maximal order volume')) / price) // 1
 
 
 def is_symbolic_limitation_ok(symbol):
@@ -124,16 +240,13 @@ def is_symbolic_limitation_ok(symbol):
     return True if count < parameters.getint('symbolic limitation') else False
 
 
-def check_symbols_file(api):
-    """ Compiles a list of traded symbols if it doesn't exist. """
-    if not os.path.exists(SYMBOLS_FILE):
-        log_this(f'{SYMBOLS_FILE} doesn\'t exist. Making list of symbols...')
-        symbols_file = open(SYMBOLS_FILE, 'w')
-        assets_list = [asset.symbol + '\n' for asset in api.list_assets() if asset.tradable]
-        symbols_file.writelines(assets_list)
-        symbols_file.close()
-        log_this(f'{SYMBOLS_FILE} ready.')
-
-
 if __name__ == '__main__':
-    run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--daemon', action='store_true', help='keep running and follow the market clock')
+    parser.add_argument('--profile', metavar='FILE', help='profile the run with cProfile (FILE.txt for a report)')
+    args = parser.parse_args()
+    with profile(args.profile) if args.profile else nullcontext():
+        if args.daemon:
+            run_daemon()
+        else:
+            run()
@@ -0,0 +1,167 @@
+import sqlite3
+import atexit
+import argparse
+import pandas as pd
+import alpaca_trade_api as tradeapi
+from collections import defaultdict
+
+from config import parameters
+from logs import log_this, DEBUG, ERROR
+
+
+BARS_DATABASE_FILE = 'bars.db'
+EXCHANGE_TIMEZONE = 'America/New_York'
+
+
+def split_into_chunks(items, size):
+    """ Splits a list into chunks of the given size. """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class BarStore:
+    """ Local store of daily bars keyed by symbol and bar time.
+        Only bars since the last stored one are requested via API. """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    def connection(self):
+        """ Opens the connection on first use. """
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS "bars" ("symbol"	TEXT NOT NULL,
+                                                                    "time"	INTEGER NOT NULL,
+                                                                    "open"	REAL,
+                                                                    "high"	REAL,
+                                                                    "low"	REAL,
+                                                                    "close"	REAL,
+                                                                    "volume"	REAL,
+                                                                    PRIMARY KEY("symbol", "time")
+                                                                    ) WITHOUT ROWID''')
+        return self._conn
+
+    def close(self):
+        """ Closes the connection. """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get_last_times(self):
+        """ Getting the time of the last stored bar of every symbol. """
+        return dict(self.connection().execute('SELECT symbol, MAX(time) FROM bars GROUP BY symbol'))
+
+    def save(self, bars_by_symbol):
+        """ Saving raw bars, replacing the stored ones with the same time. """
+        with self.connection() as conn:
+            conn.executemany('INSERT OR REPLACE INTO bars (symbol, time, open, high, low, close, volume) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             ((symbol, bar['t'], bar['o'], bar['h'], bar['l'], bar['c'], bar['v'])
+                              for symbol, bars in bars_by_symbol.items() for bar in bars))
+
+    def refresh(self, api, symbols, limit=2):
+        """ Requests bars since the last stored one for every symbol, as the last one may be partial.
+            Symbols without stored bars get the last limit bars. """
+        last_times = self.get_last_times()
+        symbols_by_start = defaultdict(list)
+        for symbol in symbols:
+            symbols_by_start[last_times.get(symbol)].append(symbol)
+        requests_count = 0
+        for start, start_symbols in symbols_by_start.items():
+            for chunk in split_into_chunks(start_symbols, parameters.getint('bars request size')):
+                try:
+                    if start is None:
+                        barset = api.get_barset(chunk, 'day', limit=limit)
+                    else:
+                        start_time = pd.Timestamp(start, unit='s', tz='UTC').tz_convert(EXCHANGE_TIMEZONE)
+                        barset = api.get_barset(chunk, 'day', start=start_time.isoformat(), limit=1000)
+                except tradeapi.rest.APIError as apierror:
+                    log_api_error(chunk, apierror)
+                    continue
+                requests_count += 1
+                self.save(barset._raw)
+        log_this('Bars of %s symbols are refreshed with %s requests.', len(symbols), requests_count, level=DEBUG)
+
+    def backfill(self, api, symbols, days):
+        """ Requests the last days bars (up to 1000) for historical research and backtests. """
+        for chunk in split_into_chunks(symbols, parameters.getint('bars request size')):
+            try:
+                barset = api.get_barset(chunk, 'day', limit=min(days, 1000))
+            except tradeapi.rest.APIError as apierror:
+                log_api_error(chunk, apierror)
+                continue
+            self.save(barset._raw)
+
+    def get_last_closes(self):
+        """ Getting the close price of the last stored bar of every symbol. """
+        return {symbol: close for symbol, close, _ in
+                self.connection().execute('SELECT symbol, close, MAX(time) FROM bars GROUP BY symbol')}
+
+    def get_daily_bars(self, symbols, limit=2):
+        """ Yields (symbol, raw bars) pairs with the last limit stored bars of every symbol, oldest first. """
+        conn = self.connection()
+        for symbol in symbols:
+            rows = conn.execute('SELECT time, open, high, low, close, volume FROM bars WHERE symbol = ? '
+                                'ORDER BY time DESC LIMIT ?', (symbol, limit)).fetchall()
+            yield symbol, [{'t': t, 'o': o, 'h': h, 'l': l, 'c': c, 'v': v} for t, o, h, l, c, v in reversed(rows)]
+
+    def export(self, path):
+        """ Exports all stored bars to a CSV or Parquet file for backtests. """
+        bars = pd.read_sql_query('SELECT symbol, time, open, high, low, close, volume FROM bars '
+                                 'ORDER BY symbol, time', self.connection())
+        if path.endswith('.parquet'):
+            bars.to_parquet(path, index=False)
+        else:
+            bars.to_csv(path, index=False)
+
+
+def get_two_day_volumes(api, symbols):
+    """ Getting the sum of the previous and current daily volumes of many symbols per request from snapshots.
+        Symbols of failed requests get the volumes of their last two stored bars. Returns the volumes
+        and the symbols of failed requests without stored bars: they can't be filtered by volume. """
+    volumes = dict()
+    unchecked = list()
+    feed = parameters.get('snapshot feed')
+    for chunk in split_into_chunks(symbols, parameters.getint('snapshots request size')):
+        query = {'symbols': ','.join(chunk), 'feed': feed} if feed else {'symbols': ','.join(chunk)}
+        try:
+            snapshots = api.data_get('/stocks/snapshots', query, api_version='v2')
+        except tradeapi.rest.APIError as apierror:
+            log_api_error(chunk, apierror)
+            for symbol, bars in bar_store.get_daily_bars(chunk):
+                if len(bars) >= 2:
+                    volumes[symbol] = bars[0]['v'] + bars[1]['v']
+                else:
+                    unchecked.append(symbol)
+            continue
+        for symbol, snapshot in snapshots.items():
+            if snapshot and snapshot.get('prevDailyBar') and snapshot.get('dailyBar'):
+                volumes[symbol] = snapshot['prevDailyBar']['v'] + snapshot['dailyBar']['v']
+    return volumes, unchecked
+
+
+def log_api_error(chunk, apierror):
+    """ Logs an API error of a market data request. """
+    log_this(f'Something went wrong with API while getting market data for {chunk[0]}..{chunk[-1]}!', level=ERROR)
+    log_this(str(apierror), notime_flag=True, level=ERROR)
+
+
+bar_store = BarStore(BARS_DATABASE_FILE)
+atexit.register(bar_store.close)
+
+
+if __name__ == '__main__':
+    from main import API_KEY, API_SECRET, APCA_API_BASE_URL, SYMBOLS_FILE
+    from assets import get_universe
+    parser = argparse.ArgumentParser(description='Fills the local bar store and exports it.')
+    parser.add_argument('--backfill', type=int, metavar='DAYS', help='request the last DAYS bars of all symbols')
+    parser.add_argument('--export', metavar='FILE', help='export stored bars to a CSV or Parquet file')
+    args = parser.parse_args()
+    if args.backfill:
+        api = tradeapi.REST(API_KEY, API_SECRET, APCA_API_BASE_URL, api_version='v2')
+        bar_store.backfill(api, get_universe(api, SYMBOLS_FILE), args.backfill)
+    if args.export:
+        bar_store.export(args.export)
@@ -0,0 +1,142 @@
+import io
+import os
+import time
+import pstats
+import cProfile
+import threading
+import alpaca_trade_api as tradeapi
+from requests.exceptions import HTTPError
+from functools import wraps
+from collections import Counter
+from contextlib import contextmanager
+
+
+METRICS_PREFIX = 'alpaca_bot'
+
+
+class Metrics:
+    """ Timing spans and counters of a run. Spans are kept as [count, total seconds, max seconds]. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Starts a new run. """
+        with self._lock:
+            self.started_at = time.time()
+            self.spans = dict()
+            self.counters = Counter()
+
+    @contextmanager
+    def span(self, name):
+        """ Times the block. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """ Decorator timing every call of a function. """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_time(self, name, seconds):
+        """ Adds a timed call to the span. """
+        with self._lock:
+            span = self.spans.setdefault(name, [0, 0.0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+            span[2] = max(span[2], seconds)
+
+    def count(self, name, value=1):
+        """ Increases the counter. """
+        with self._lock:
+            self.counters[name] += value
+
+    def summary(self):
+        """ Makes a dict of the run duration, spans and counters. """
+        with self._lock:
+            return {'duration': round(time.time() - self.started_at, 3),
+                    'spans': {name: {'count': count, 'total': round(total, 6), 'max': round(longest, 6)}
+                              for name, (count, total, longest) in sorted(self.spans.items())},
+                    'counters': dict(sorted(self.counters.items()))}
+
+    def to_prometheus(self):
+        """ Makes the Prometheus text exposition of spans and counters. """
+        lines = [f'# TYPE {METRICS_PREFIX}_span_seconds summary']
+        with self._lock:
+            for name, (count, total, _) in sorted(self.spans.items()):
+                lines.append(f'{METRICS_PREFIX}_span_seconds_count{{name="{name}"}} {count}')
+                lines.append(f'{METRICS_PREFIX}_span_seconds_sum{{name="{name}"}} {total:.6f}')
+            lines.append(f'# TYPE {METRICS_PREFIX}_span_max_seconds gauge')
+            for name, (_, _, longest) in sorted(self.spans.items()):
+                lines.append(f'{METRICS_PREFIX}_span_max_seconds{{name="{name}"}} {longest:.6f}')
+            lines.append(f'# TYPE {METRICS_PREFIX}_events_total counter')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{METRICS_PREFIX}_events_total{{name="{name}"}} {value}')
+            lines.append(f'# TYPE {METRICS_PREFIX}_run_seconds gauge')
+            lines.append(f'{METRICS_PREFIX}_run_seconds {time.time() - self.started_at:.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path):
+        """ Writes Prometheus text metrics to the file (e.g. for the node_exporter textfile collector). """
+        with open(path + '.tmp', 'w') as metrics_file:
+            metrics_file.write(self.to_prometheus())
+        # Replaced at once so that a collector never reads a half-written file
+        os.replace(path + '.tmp', path)
+
+
+class InstrumentedREST:
+    """ Wraps a REST client: every API call is timed as api.<method>, errors are counted. """
+
+    def __init__(self, api, run_metrics):
+        self._api = api
+        self._metrics = run_metrics
+
+    def __getattr__(self, name):
+        attribute = getattr(self._api, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        @wraps(attribute)
+        def call(*args, **kwargs):
+            try:
+                with self._metrics.span(f'api.{name}'):
+                    return attribute(*args, **kwargs)
+            except (tradeapi.rest.APIError, HTTPError) as error:
+                self._metrics.count('api_errors')
+                if error.response is not None and error.response.status_code == 429:
+                    self._metrics.count('api_rate_limited')
+                raise
+        return call
+
+
+@contextmanager
+def profile(path):
+    """ Profiles the block with cProfile. A .txt path gets a readable report, any other one pstats data. """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if path.endswith('.txt'):
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(50)
+            with open(path, 'w') as report_file:
+                report_file.write(report.getvalue())
+        else:
+            profiler.dump_stats(path)
+
+
+metrics = Metrics()
+timed = metrics.timed
+span = metrics.span
+count = metrics.count
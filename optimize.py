@@ -0,0 +1,119 @@
+import os
+import re
+import random
+import argparse
+import itertools
+import configparser
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from config import parameters, SETTINGS_FILE
+from backtest import load_bars, prepare_steps, run_backtest
+
+
+TUNABLE_PARAMETERS = ('current-lowest gap', 'least trade volume', 'check target percent',
+                      'sell target percent', 'buy-order checking time', 'sell-order lifetime')
+CACHE_DIR = 'cache/steps/'
+
+_data = None
+
+
+def parse_range(spec):
+    """ Parses 'name=start:stop:step' or 'name=value,value,...' into the name and a list of values. """
+    name, values = (part.strip() for part in spec.split('=', 1))
+    if name not in TUNABLE_PARAMETERS:
+        raise ValueError(f'{name} is not one of: {", ".join(TUNABLE_PARAMETERS)}')
+    if ':' in values:
+        start, stop, step = (float(value) for value in values.split(':'))
+        count = int(round((stop - start) / step)) + 1
+        values = [f'{start + step * index:.10g}' for index in range(count)]
+    else:
+        values = [value.strip() for value in values.split(',')]
+    return name, values
+
+
+def make_combinations(ranges, samples=None, seed=None):
+    """ Makes all combinations of the ranges, or the given number of random ones. """
+    names = [name for name, _ in ranges]
+    grids = [values for _, values in ranges]
+    total = int(np.prod([len(values) for values in grids]))
+    if samples is None or samples >= total:
+        return [dict(zip(names, values)) for values in itertools.product(*grids)]
+    combinations = list()
+    for number in random.Random(seed).sample(range(total), samples):
+        values = list()
+        for grid in reversed(grids):
+            number, index = divmod(number, len(grid))
+            values.append(grid[index])
+        combinations.append(dict(zip(names, reversed(values))))
+    return combinations
+
+
+def make_settings(overrides):
+    """ Makes a parameters section with some values replaced. """
+    config = configparser.ConfigParser()
+    config.read_dict({'parameters': {**dict(parameters), **overrides}})
+    return config['parameters']
+
+
+def cache_steps(data, cache_dir=CACHE_DIR):
+    """ Saves prepared steps as .npy files to be memory-mapped by the workers. """
+    os.makedirs(cache_dir, exist_ok=True)
+    for name, array in data.items():
+        np.save(os.path.join(cache_dir, f'{name}.npy'), array)
+
+
+def _load_cached_steps(cache_dir):
+    global _data
+    _data = {name[:-4]: np.load(os.path.join(cache_dir, name), mmap_mode='r')
+             for name in os.listdir(cache_dir) if name.endswith('.npy')}
+
+
+def _evaluate(overrides):
+    ledger, summary = run_backtest(_data, make_settings(overrides))
+    return overrides, summary
+
+
+def optimize(data, combinations, workers=None, cache_dir=CACHE_DIR):
+    """ Runs backtests of all combinations in a process pool.
+        Returns (overrides, summary) pairs, the most profitable and least drawn down first. """
+    cache_steps(data, cache_dir)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_cached_steps,
+                             initargs=(cache_dir,)) as executor:
+        results = list(executor.map(_evaluate, combinations, chunksize=max(len(combinations) // 64, 1)))
+    return sorted(results, key=lambda result: (-result[1]['total profit'], result[1]['max drawdown']))
+
+
+def write_settings(overrides, path, template=SETTINGS_FILE):
+    """ Writes a copy of the settings file with the parameters replaced. """
+    with open(template, 'r') as template_file:
+        lines = template_file.readlines()
+    for number, line in enumerate(lines):
+        match = re.match(r'\s*([^#;:=][^:=]*?)\s*([:=])', line)
+        if match and match.group(1) in overrides:
+            lines[number] = f'{match.group(1)}{match.group(2)} {overrides[match.group(1)]}\n'
+    with open(path, 'w') as settings_file:
+        settings_file.writelines(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Searches the best parameters by backtests.')
+    parser.add_argument('bars', nargs='+', help='CSV or Parquet files with symbol, time, open, high, low, close, '
+                                                'volume columns')
+    parser.add_argument('--range', action='append', required=True, dest='ranges', type=parse_range,
+                        help='name=start:stop:step or name=value,value,...')
+    parser.add_argument('--timeframe', choices=('day', 'minute'), default='day')
+    parser.add_argument('--random', type=int, help='number of random combinations instead of the full grid')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--output', default='settings.optimized.ini')
+    args = parser.parse_args()
+    step_minutes = parameters.getint('scan interval') if args.timeframe == 'minute' else None
+    steps = prepare_steps(load_bars(args.bars), step_minutes)
+    ranking = optimize(steps, make_combinations(args.ranges, args.random, args.seed), args.workers)
+    for best_overrides, best_summary in ranking[:args.top]:
+        print(best_overrides, best_summary)
+    write_settings(ranking[0][0], args.output)
+    print(f'The best parameters are saved to {args.output}. '
+          f'Run the bot with SETTINGS_FILE={args.output} to use them.')
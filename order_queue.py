@@ -0,0 +1,90 @@
+import time
+import random
+import threading
+import requests
+import alpaca_trade_api as tradeapi
+from concurrent.futures import ThreadPoolExecutor
+
+from config import parameters
+from logs import log_this, DEBUG
+
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+
+class TokenBucket:
+    """ Allows rate calls per second on average and bursts of up to capacity calls. """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Waits for a token and takes it. """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class OrderQueue:
+    """ Runs order requests in a pool of worker threads. Requests are throttled by a token bucket,
+        retried after transient errors with jittered exponential backoff and deduplicated by key
+        (the client order id): a request with the key of a pending one gets the pending future. """
+
+    def __init__(self, workers, rate_per_minute, retries):
+        self.retries = retries
+        self._bucket = TokenBucket(rate_per_minute / 60, max(workers, 1))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='orders')
+        self._pending = dict()
+        # Reentrant, as a done callback runs in the calling thread if the future is already done
+        self._lock = threading.RLock()
+
+    def call(self, key, function, *args, **kwargs):
+        """ Queues a request and returns its future. """
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._run, function, args, kwargs)
+                self._pending[key] = future
+                future.add_done_callback(lambda _: self._forget(key))
+            return future
+
+    def _forget(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def _run(self, function, args, kwargs):
+        for attempt in range(self.retries + 1):
+            self._bucket.acquire()
+            try:
+                return function(*args, **kwargs)
+            except Exception as error:
+                if attempt == self.retries or not is_transient(error):
+                    raise
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                log_this('Order request failed (%r), retrying in %.1fs...', error, delay, level=DEBUG)
+                time.sleep(delay)
+
+
+def is_transient(error):
+    """ Checks whether a failed request is worth retrying: rate limit, server and connection errors. """
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, (tradeapi.rest.APIError, requests.exceptions.HTTPError)) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
+
+
+order_queue = OrderQueue(parameters.getint('order workers'), parameters.getfloat('order rate limit'),
+                         parameters.getint('order retries'))
@@ -1,46 +1,174 @@
+import uuid
+import sqlite3
+import requests
 import alpaca_trade_api as tradeapi
+from datetime import datetime
 
-from logs import log_this
-from database import insert_into_database
+from logs import log_this, ERROR
+from database import (insert_into_database, insert_applied_intent, after_commit, insert_profit, get_balance,
+                      transaction)
+from journal import journal, OPEN, APPLIED, FAILED
+from limits import hourly_limiter
+from metrics import count
+from order_queue import order_queue
+
+
+# Queued buy orders: client_order_id: (symbol, quantity, price, future)
+pending_buys = dict()
 
 
 def make_limit_buy_order(api, symbol, quantity, price):
-    """ Makes an limit buy order via API. """
-    try:
-        order = api.submit_order(symbol=symbol, side='buy', type='limit',
-                                 qty=str(quantity), time_in_force='day', limit_price=price)
-    except tradeapi.rest.APIError as apierror:
-        log_this(f'Something went wrong with the submission of a limit buy order! Please check terminal! '
+    """ Queues a limit buy order. It is recorded by apply_buy_orders once submitted. """
+    client_order_id = str(uuid.uuid4())
+    if not hourly_limiter.reserve(client_order_id):
+        log_this(f'Hourly limitation is reached. The order is not submitted. '
                  f'({symbol}, {quantity}, {price})')
-        log_this(str(apierror), notime_flag=True)
-    else:
-        log_this(f'Limit Buy-Order {order.id} is submitted.')
-        insert_into_database(order.id, order.symbol)
+        return
+    try:
+        journal.open_intent(client_order_id, symbol, 'buy', 'limit', quantity, price)
+    except sqlite3.Error as error:
+        log_this(f'Something went wrong with the order journal! The order is not submitted. '
+                 f'({symbol}, {quantity}, {price}, {error!r})', level=ERROR)
+        hourly_limiter.release(client_order_id)
+        return
+    future = order_queue.call(client_order_id, send_order, api, client_order_id, symbol=symbol, side='buy',
+                              type='limit', qty=str(quantity), time_in_force='day', limit_price=price)
+    pending_buys[client_order_id] = (symbol, quantity, price, future)
 
 
-def make_sell_order(api, symbol, order_type, quantity, buy_order_id, limit_price=None):
-    """ Makes an sell order via API. """
+def apply_buy_orders(api, wait=False):
+    """ Records submitted buy orders with their funds reservations. If wait, waits for all queued ones. """
+    for client_order_id, (symbol, quantity, price, future) in list(pending_buys.items()):
+        if not (wait or future.done()):
+            continue
+        del pending_buys[client_order_id]
+        try:
+            order = future.result()
+        except Exception as error:
+            log_this(f'Something went wrong with the submission of a limit buy order! Please check terminal! '
+                     f'({symbol}, {quantity}, {price})', level=ERROR)
+            log_this(repr(error), notime_flag=True, level=ERROR)
+            order = check_failed_submission(api, client_order_id, error)
+        if order is None:
+            hourly_limiter.release(client_order_id)
+        else:
+            log_this(f'Limit Buy-Order {order.id} is submitted.')
+            count('buy_orders_placed')
+            hourly_limiter.register(order.id, client_order_id)
+            with transaction():
+                record_order(order, client_order_id)
+                reserve_funds(symbol, quantity, price)
+
+
+def get_pending_amount():
+    """ Calculates the money of queued buy orders. """
+    return sum(quantity * price for _, quantity, price, _ in pending_buys.values())
+
+
+def make_sell_order(api, symbol, order_type, quantity, buy_order_id, limit_price=None, replaces=None):
+    """ Makes an sell order via API. Its client order id comes from the buy order
+        (or the sell order it replaces), so a retry after a crash finds the order submitted before.
+        Returns whether the order is submitted and recorded. """
+    client_order_id = f'resell-{replaces}' if replaces else f'sell-{buy_order_id}'
     try:
         if limit_price:
-            order = api.submit_order(symbol=symbol, side='sell', type=order_type,
-                             qty=quantity, time_in_force='gtc', limit_price=limit_price)
+            order = submit_order(api, client_order_id, buy_order_id, symbol=symbol, side='sell', type=order_type,
+                                 qty=quantity, time_in_force='gtc', limit_price=limit_price)
         else:
-            order = api.submit_order(symbol=symbol, side='sell', type=order_type, qty=quantity, time_in_force='gtc')
-    except tradeapi.rest.APIError as apierror:
+            order = submit_order(api, client_order_id, buy_order_id, symbol=symbol, side='sell', type=order_type,
+                                 qty=quantity, time_in_force='gtc')
+    except (tradeapi.rest.APIError, requests.exceptions.RequestException) as error:
         log_this(f'Something went wrong with the submission of a {order_type} sell order! Please check terminal! '
-                 f'({symbol}, {quantity}, {limit_price})')
-        log_this(str(apierror), notime_flag=True)
+                 f'({symbol}, {quantity}, {limit_price})', level=ERROR)
+        log_this(repr(error), notime_flag=True, level=ERROR)
+    except sqlite3.Error as error:
+        log_this(f'Something went wrong with the order journal! The order is not submitted. '
+                 f'({symbol}, {quantity}, {limit_price}, {error!r})', level=ERROR)
     else:
         log_this(f'The {order_type} sell-order {order.id} is submitted.')
+        count('sell_orders_placed')
+        return record_order(order, client_order_id, buy_order_id)
+    return False
+
+
+def submit_order(api, client_order_id, buy_order_id=None, **order):
+    """ Submits an order after writing its intent to the journal. If the intent is still open
+        from an earlier attempt, the order may have been submitted before a crash, so it is looked up first. """
+    intent = journal.get_intent(client_order_id)
+    if intent is not None and intent.status == OPEN:
+        try:
+            return api.get_order_by_client_order_id(client_order_id)
+        except tradeapi.rest.APIError:
+            pass
+    journal.open_intent(client_order_id, order['symbol'], order['side'], order['type'], order['qty'],
+                        order.get('limit_price'), buy_order_id)
+    try:
+        return order_queue.call(client_order_id, send_order, api, client_order_id, **order).result()
+    except (tradeapi.rest.APIError, requests.exceptions.RequestException) as error:
+        submitted_order = check_failed_submission(api, client_order_id, error)
+        if submitted_order is None:
+            raise
+        return submitted_order
+
+
+def check_failed_submission(api, client_order_id, error):
+    """ Settles the intent of an order which submission has failed after all retries.
+        After a connection error, timeout or server error the order may have reached the broker, so it is looked up
+        by its client order id and returned if found; otherwise the intent fails. A rejected or rate limited order
+        fails at once. """
+    if isinstance(error, tradeapi.rest.APIError) and (error.status_code or 0) < 500:
+        journal.close_intent(client_order_id, FAILED)
+        return None
+    if isinstance(error, (tradeapi.rest.APIError, requests.exceptions.RequestException)):
+        try:
+            return api.get_order_by_client_order_id(client_order_id)
+        except Exception:
+            log_this(f'The order {client_order_id} is not found, its intent is failed.', level=ERROR)
+            journal.close_intent(client_order_id, FAILED)
+    return None
+
+
+def send_order(api, client_order_id, **order):
+    """ Sends an order. If an earlier attempt has reached the broker, its order is returned. """
+    try:
+        return api.submit_order(client_order_id=client_order_id, **order)
+    except tradeapi.rest.APIError as apierror:
+        # A taken client order id is a validation error (422): the order is found by it, otherwise it is another one
+        if apierror.status_code != 422:
+            raise
+        try:
+            return api.get_order_by_client_order_id(client_order_id)
+        except tradeapi.rest.APIError:
+            raise apierror
+
+
+def record_order(order, client_order_id, buy_order_id=None):
+    """ Records a submitted order and closes its intent once the record is committed.
+        It is called right after the submission, so the record doesn't wait for other broker calls.
+        Returns whether the record is committed (inside an outer transaction it is committed later, so False). """
+    committed = list()
+    with transaction():
         insert_into_database(order.id, order.symbol, buy_order_id)
+        insert_applied_intent(client_order_id, order.id)
+        after_commit(lambda: journal.close_intent(client_order_id, APPLIED))
+        after_commit(lambda: committed.append(order.id))
+    return bool(committed)
+
+
+def reserve_funds(symbol, quantity, price):
+    """ Takes the money of a buy order from the balances. """
+    time_now = str(datetime.utcnow())[:19]
+    insert_profit(get_balance('total') - quantity * price, get_balance('active') - quantity * price, time_now,
+                  symbol, 0, 'None', 'None', nolog_flag=True)
 
 
 def cancel_order_id(api, order_id):
     """ Cancels an order via API. """
     try:
-        api.cancel_order(order_id)
-    except tradeapi.rest.APIError as apierror:
-        log_this(f'Something went wrong when canceling an order {order_id}! Please check terminal!')
-        log_this(str(apierror), notime_flag=True)
+        order_queue.call(f'cancel-{order_id}', api.cancel_order, order_id).result()
+    except (tradeapi.rest.APIError, requests.exceptions.RequestException) as error:
+        log_this(f'Something went wrong when canceling an order {order_id}! Please check terminal!', level=ERROR)
+        log_this(repr(error), notime_flag=True, level=ERROR)
     else:
         log_this(f'Order {order_id} is canceled.')
+        count('orders_canceled')
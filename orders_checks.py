@@ -3,104 +3,290 @@ from datetime import datetime, timedelta
 
 from config import parameters
 from database import (update_database, delete_from_database, insert_profit, get_list_of_orders,
-                      get_buy_order_id, get_balance, get_todays_profit, get_total_profit)
-from logs import log_this
-from orders import make_sell_order, cancel_order_id
+                      get_buy_order_id, get_balance, get_todays_profit, get_total_profit, transaction,
+                      get_order_side, get_applied_intents)
+from logs import log_this, DEBUG, ERROR
+from orders import make_sell_order, cancel_order_id, record_order, reserve_funds
+from journal import journal, APPLIED, FAILED
+from metrics import span, count
+
+
+SNAPSHOT_PAGE_SIZE = 500
+SNAPSHOT_MAX_PAGES = 10
+RECOVERY_PAGE_SIZE = 500
 
 
 def check_orders(api):
     """ Iterates over all orders and checks them. """
-    log_this('Checking buy orders starts...')
     list_buy_orders = get_list_of_orders('buy_orders')
-    for order_id in list_buy_orders:
-        check_buy_order(api, order_id)
-    log_this('Checking sell orders starts...')
     list_sell_orders = get_list_of_orders('sell_orders')
-    for order_id in list_sell_orders:
-        check_sell_order(api, order_id)
+    # Buy orders of the sell orders are older, but take_profit needs them too
+    buy_order_ids = [get_buy_order_id(order_id) for order_id in list_sell_orders]
+    with span('phase.orders_snapshot'):
+        orders = get_orders_snapshot(api, list_buy_orders + list_sell_orders + buy_order_ids)
+    log_this('Checking buy orders starts...', level=DEBUG)
+    with span('phase.buy_orders_checks'):
+        for order_id in list_buy_orders:
+            check_buy_order(api, order_id, orders)
+    log_this('Checking sell orders starts...', level=DEBUG)
+    with span('phase.sell_orders_checks'):
+        for order_id in list_sell_orders:
+            check_sell_order(api, order_id, orders)
+    count('orders_checked', len(list_buy_orders) + len(list_sell_orders))
     log_this(f'Today\'s profit: ${get_todays_profit()}')
     log_this(f'Total profit: ${get_total_profit()}')
 
 
-def check_buy_order(api, order_id):
+def check_order_update(api, event, order):
+    """ Checks a tracked order right after its trade update event. """
+    side = get_order_side(order.id)
+    if side:
+        log_this(f'Trade update: {event} of {side} order {order.id}.')
+        if side == 'buy':
+            check_buy_order(api, order.id, {order.id: order})
+        else:
+            check_sell_order(api, order.id, {order.id: order})
+
+
+def recover_orders(api):
+    """ Reconciles open intents of the journal with the broker after a crash by pages of orders
+        submitted since the oldest intent. Unrecorded buy orders are recorded with their reserved funds,
+        unrecorded sell orders with their buy orders, intents which haven't reached the broker are closed. """
+    intents = journal.get_open_intents()
+    if not intents:
+        return
+    applied = get_applied_intents([intent.client_order_id for intent in intents])
+    if applied is None:
+        return
+    for client_order_id in applied:
+        journal.close_intent(client_order_id, APPLIED)
+    intents = [intent for intent in intents if intent.client_order_id not in applied]
+    if not intents:
+        return
+    log_this(f'Recovering {len(intents)} unrecorded order intents...')
+    orders, is_complete = get_orders_since(api, datetime.fromisoformat(intents[0].created_at) - timedelta(minutes=1),
+                                           {intent.client_order_id for intent in intents})
+    if orders is None:
+        return
+    for intent in intents:
+        order = orders.get(intent.client_order_id)
+        if order is None:
+            if is_complete:
+                log_this(f'The {intent.side} order of {intent.symbol} ({intent.client_order_id}) '
+                         f'hasn\'t been submitted.')
+                journal.close_intent(intent.client_order_id, FAILED)
+        elif intent.side == 'buy':
+            with transaction():
+                record_order(order, intent.client_order_id)
+                reserve_funds(intent.symbol, intent.qty, intent.limit_price)
+            log_this(f'Buy-Order {order.id} is recovered.')
+        elif record_order(order, intent.client_order_id, intent.buy_order_id):
+            log_this(f'Sell-Order {order.id} is recovered.')
+
+
+def get_orders_since(api, after, client_order_ids):
+    """ Gets orders submitted after the time page by page until all of the client_order_ids are found.
+        Returns the orders by their client order ids and whether all orders since the time are there
+        (or None and False if API has failed). """
+    orders = dict()
+    while True:
+        try:
+            page = api.list_orders(status='all', limit=RECOVERY_PAGE_SIZE, direction='asc', after=after)
+        except tradeapi.rest.APIError as apierror:
+            log_this('Something went wrong with API while recovering orders!', level=ERROR)
+            log_this(str(apierror), notime_flag=True, level=ERROR)
+            return None, False
+        for order in page:
+            orders[order.client_order_id] = order
+        if len(page) < RECOVERY_PAGE_SIZE:
+            return orders, True
+        if client_order_ids <= orders.keys() or page[-1]._raw['created_at'] == after:
+            return orders, False
+        after = page[-1]._raw['created_at']
+
+
+def get_orders_snapshot(api, order_ids):
+    """ Gets recent orders page by page until all of the order_ids are found. """
+    orders = dict()
+    until = None
+    for _ in range(SNAPSHOT_MAX_PAGES):
+        if all(order_id in orders for order_id in order_ids):
+            break
+        try:
+            page = api.list_orders(status='all', limit=SNAPSHOT_PAGE_SIZE, until=until, direction='desc')
+        except tradeapi.rest.APIError as apierror:
+            log_this('Something went wrong with API while getting list of orders!', level=ERROR)
+            log_this(str(apierror), notime_flag=True, level=ERROR)
+            break
+        for order in page:
+            orders[order.id] = order
+        if len(page) < SNAPSHOT_PAGE_SIZE or page[-1]._raw['created_at'] == until:
+            break
+        until = page[-1]._raw['created_at']
+    return orders
+
+
+def get_order(api, order_id, orders=None):
+    """ Gets an order from the snapshot or via API if it isn't there. """
+    if orders and order_id in orders:
+        return orders[order_id]
+    return api.get_order(order_id)
+
+
+def check_buy_order(api, order_id, orders=None):
     """ Checks a fulfillment of buy order. """
     try:
-        order = api.get_order(order_id)
+        order = get_order(api, order_id, orders)
     except tradeapi.rest.APIError as apierror:
-        log_this(f'Something went wrong with API while getting buy order {order_id}!')
-        log_this(str(apierror), notime_flag=True)
+        log_this(f'Something went wrong with API while getting buy order {order_id}!', level=ERROR)
+        log_this(str(apierror), notime_flag=True, level=ERROR)
     else:
         order_time = datetime.fromisoformat(str(datetime.utcnow()) + '+00:00') \
                      - datetime.fromisoformat(str(order.created_at))
-        time_limit = timedelta(minutes=parameters.getint('buy-order checking time'))
-        if order.status == 'filled':
+        action = buy_order_action(order.status, float(order.filled_qty), order_time)
+        if action in ('cancel and market sell', 'cancel'):
+            order = cancel_buy_order(api, order)
+            if order is None:
+                return
+            action = buy_order_action(order.status, float(order.filled_qty), order_time)
+        if action == 'limit sell':
             log_this(f'Buy-Order {order_id} is filled.')
-            log_this(f'Making Limit Sell-Order...')
-            target_percent = 1 + parameters.getfloat('sell target percent') / 100
-            target_price = round(float(order.limit_price) * target_percent, 2)
-            make_sell_order(api, order.symbol, 'limit', order.qty, order_id, target_price)
-            delete_from_database(order.side, order_id)
-        elif order.status == 'canceled':
-            if order.filled_qty == 0:
-                delete_from_database(order.side, order_id)
-            else:
-                make_sell_order(api, order.symbol, 'market', order.filled_qty, order_id)
+            log_this('Making Limit Sell-Order...', level=DEBUG)
+            # Until its sell order is recorded, the buy order is kept, so the sell order is made (or found) again
+            if make_sell_order(api, order.symbol, 'limit', order.qty, order_id, sell_target_price(order.limit_price)):
                 delete_from_database(order.side, order_id)
-        elif order_time >= time_limit:
-            if order.status == 'partially_filled':
-                if order_time < time_limit * 2:
-                    log_this(f'Buy-Order {order_id} is partially filled. Let\'s wait.')
-                    update_database(order.side, order_id, str(datetime.utcnow()))
-                else:
-                    cancel_order_id(api, order_id)
-                    make_sell_order(api, order.symbol, 'market', order.filled_qty, order_id)
-                    delete_from_database(order.side, order_id)
-            elif order.status == 'new':
-                cancel_order_id(api, order_id)
-                delete_from_database(order.side, order_id)
-            else:
-                log_this(f'Buy-Order {order_id} has unexpected order status: {order.status}. Please check.')
+        elif action == 'forget':
+            forget_buy_order(order)
+        elif action == 'market sell':
+            if make_sell_order(api, order.symbol, 'market', order.filled_qty, order_id):
+                forget_buy_order(order)
+        elif action == 'wait':
+            log_this(f'Buy-Order {order_id} is partially filled. Let\'s wait.')
+            update_database(order.side, order_id, str(datetime.utcnow()))
+        elif action == 'unexpected':
+            log_this(f'Buy-Order {order_id} has unexpected order status: {order.status}. Please check.',
+                     level=ERROR)
+
+
+def buy_order_action(status, filled_qty, order_time, settings=parameters):
+    """ Decides what to do with a buy order of the given status and age. """
+    time_limit = timedelta(minutes=settings.getint('buy-order checking time'))
+    if status == 'filled':
+        return 'limit sell'
+    elif status == 'canceled':
+        return 'forget' if filled_qty == 0 else 'market sell'
+    elif status == 'pending_cancel':
+        return None
+    elif order_time >= time_limit:
+        if status == 'partially_filled':
+            return 'wait' if order_time < time_limit * 2 else 'cancel and market sell'
+        elif status == 'new':
+            return 'cancel'
+        else:
+            return 'unexpected'
+    return None
 
 
-def check_sell_order(api, order_id):
+def cancel_buy_order(api, order):
+    """ Cancels a buy order and gets it again, as it may have been filled further before the cancel.
+        Returns the order once it is canceled (or filled), so its filled quantity is final,
+        or None if the cancel is still pending: then the order is checked again later. """
+    cancel_order_id(api, order.id)
+    try:
+        order = api.get_order(order.id)
+    except tradeapi.rest.APIError as apierror:
+        log_this(f'Something went wrong with API while getting buy order {order.id}!', level=ERROR)
+        log_this(str(apierror), notime_flag=True, level=ERROR)
+        return None
+    if order.status not in ('canceled', 'filled'):
+        log_this(f'Buy-Order {order.id} is {order.status}. It will be checked again.', level=DEBUG)
+        return None
+    return order
+
+
+def forget_buy_order(order):
+    """ Releases the funds of a finished buy order and deletes it at once.
+        Broker calls are made before, so a rollback can't lose a record of a submitted order. """
+    with transaction():
+        release_funds(order)
+        delete_from_database(order.side, order.id)
+
+
+def release_funds(order):
+    """ Returns the money reserved for the unfilled part of a canceled buy order. """
+    amount = unfilled_amount(float(order.qty), float(order.filled_qty), float(order.limit_price))
+    if amount > 0:
+        time_now = str(datetime.utcnow())[:19]
+        insert_profit(get_balance('total') + amount, get_balance('active') + amount, time_now,
+                      order.symbol, 0, order.id, 'None', nolog_flag=True)
+
+
+def unfilled_amount(quantity, filled_quantity, limit_price):
+    """ Calculates the money reserved for the unfilled part of a buy order. """
+    return (quantity - filled_quantity) * limit_price
+
+
+def sell_target_price(buy_price, settings=parameters):
+    """ Calculates the limit price of a sell order. """
+    target_percent = 1 + settings.getfloat('sell target percent') / 100
+    return round(float(buy_price) * target_percent, 2)
+
+
+def check_sell_order(api, order_id, orders=None):
     """ Checks a fulfillment of sell order. """
     try:
-        order = api.get_order(order_id)
+        order = get_order(api, order_id, orders)
     except tradeapi.rest.APIError as apierror:
-        log_this(f'Something went wrong with API while getting sell order {order_id}!')
-        log_this(str(apierror), notime_flag=True)
+        log_this(f'Something went wrong with API while getting sell order {order_id}!', level=ERROR)
+        log_this(str(apierror), notime_flag=True, level=ERROR)
     else:
         order_type = order.type
         order_time = datetime.fromisoformat(str(datetime.utcnow()) + '+00:00') \
                      - datetime.fromisoformat(str(order.created_at))
-        time_limit = timedelta(minutes=parameters.getint('sell-order lifetime'))
         buy_order_id = get_buy_order_id(order_id)
-        if order.status == 'filled':
+        action = sell_order_action(order.status, order_type, order_time)
+        if action == 'take profit':
             log_this(f'The {order_type} sell order {order_id} is filled.')
+            take_profit(api, buy_order_id, order_id, orders)
+        elif action == 'cancel and sell rest':
+            log_this(f'The {order_type} sell order {order_id} is partially filled.')
+            cancel_order_id(api, order_id)
+            make_sell_order(api, order.symbol, 'market', int(order.qty) - int(order.filled_qty), buy_order_id,
+                            replaces=order_id)
             take_profit(api, buy_order_id, order_id)
-        elif order_type != 'market' and order_time >= time_limit:
-            if order.status == 'partially_filled':
-                log_this(f'The {order_type} sell order {order_id} is partially filled.')
-                cancel_order_id(api, order_id)
-                make_sell_order(api, order.symbol, 'market', int(order.qty) - int(order.filled_qty), buy_order_id)
-                take_profit(api, buy_order_id, order_id)
-            elif order.status == 'new':
-                log_this(f'The {order_type} sell order {order_id} is not filled yet.')
-                cancel_order_id(api, order_id)
-                delete_from_database(order.side, order_id)
-                make_sell_order(api, order.symbol, 'market', order.qty, buy_order_id)
-            else:
-                log_this(f'Sell-Order {order_id} has unexpected order status: {order.status}. Please check.')
+        elif action == 'cancel and market sell':
+            log_this(f'The {order_type} sell order {order_id} is not filled yet.')
+            cancel_order_id(api, order_id)
+            delete_from_database(order.side, order_id)
+            make_sell_order(api, order.symbol, 'market', order.qty, buy_order_id, replaces=order_id)
+        elif action == 'unexpected':
+            log_this(f'Sell-Order {order_id} has unexpected order status: {order.status}. Please check.',
+                     level=ERROR)
+
+
+def sell_order_action(status, order_type, order_time, settings=parameters):
+    """ Decides what to do with a sell order of the given status and age. """
+    time_limit = timedelta(minutes=settings.getint('sell-order lifetime'))
+    if status == 'filled':
+        return 'take profit'
+    elif order_type != 'market' and order_time >= time_limit:
+        if status == 'partially_filled':
+            return 'cancel and sell rest'
+        elif status == 'new':
+            return 'cancel and market sell'
+        else:
+            return 'unexpected'
+    return None
 
 
-def take_profit(api, buy_order_id, sell_order_id):
+def take_profit(api, buy_order_id, sell_order_id, orders=None):
     """ Calculates and saves balances and profit. """
     try:
-        buy_order = api.get_order(buy_order_id)
-        sell_order = api.get_order(sell_order_id)
+        buy_order = get_order(api, buy_order_id, orders)
+        sell_order = get_order(api, sell_order_id, orders)
     except tradeapi.rest.APIError as apierror:
-        log_this(f'Something went wrong with API while getting orders!\n{buy_order_id}\n{sell_order_id}')
-        log_this(str(apierror), notime_flag=True)
+        log_this(f'Something went wrong with API while getting orders!\n{buy_order_id}\n{sell_order_id}', level=ERROR)
+        log_this(str(apierror), notime_flag=True, level=ERROR)
     else:
         total_balance = get_balance('total')
         active_balance = get_balance('active')
@@ -113,10 +299,27 @@ def take_profit(api, buy_order_id, sell_order_id):
         except TypeError:
             sell_price = float(sell_order.limit_price)
         finally:
-            buy_amount = buy_price * quantity
-            sell_amount = sell_price * quantity
-            profit = sell_amount - buy_amount
-            total_balance += sell_amount
-            active_balance += sell_amount if parameters.getboolean('plowback') else min(buy_amount, sell_amount)
-            insert_profit(total_balance, active_balance, time_now, symbol, profit, buy_order_id, sell_order_id)
-            delete_from_database(sell_order.side, sell_order_id)
+            profit, total_income, active_income = calculate_profit(buy_price, sell_price, quantity)
+            total_balance += total_income
+            active_balance += active_income
+            with transaction():
+                insert_profit(total_balance, active_balance, time_now, symbol, profit, buy_order_id,
+                              sell_order_id, hold_seconds=hold_time(buy_order, sell_order))
+                delete_from_database(sell_order.side, sell_order_id)
+
+
+def hold_time(buy_order, sell_order):
+    """ Calculates seconds between the fills of the buy and sell orders, or None if unknown. """
+    try:
+        return (sell_order.filled_at - buy_order.filled_at).total_seconds()
+    except (AttributeError, TypeError):
+        return None
+
+
+def calculate_profit(buy_price, sell_price, quantity, settings=parameters):
+    """ Calculates profit and incomes of total and active balances. """
+    buy_amount = buy_price * quantity
+    sell_amount = sell_price * quantity
+    profit = sell_amount - buy_amount
+    active_income = sell_amount if settings.getboolean('plowback') else min(buy_amount, sell_amount)
+    return profit, sell_amount, active_income
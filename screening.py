@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta, time
+
+from config import parameters
+
+
+BARS_COLUMNS = ('symbol', 'time', 'yesterday_volume', 'volume', 'low', 'high', 'close')
+
+
+def bars_to_frame(bars_by_symbol):
+    """ Builds a columnar frame of yesterday's volume and today's bar for every symbol. """
+    records = [(symbol, bars[1]['t'], bars[0]['v'], bars[1]['v'], bars[1]['l'], bars[1]['h'], bars[1]['c'])
+               for symbol, bars in bars_by_symbol if len(bars) >= 2]
+    return pd.DataFrame.from_records(records, columns=BARS_COLUMNS)
+
+
+def shortlist(volumes, size, settings=parameters):
+    """ Drops symbols which don't meet the volume check and keeps the size ones with the largest volumes. """
+    threshold = 2 * settings.getfloat('least trade volume')
+    ranked = sorted((symbol for symbol, volume in volumes.items() if not volume < threshold),
+                    key=volumes.get, reverse=True)
+    return ranked[:size] if size else ranked
+
+
+def screen(frame, today=None, settings=parameters):
+    """ Applies volume, current-lowest gap and target checks to all symbols at once.
+        Returns passed symbols with their prices, the closest to today's low first. """
+    if today is None:
+        today = datetime.date(datetime.utcnow())
+    close = frame['close'].to_numpy(dtype=np.float64)
+    passed, target_price, gap, volume = check_bars(frame['yesterday_volume'].to_numpy(dtype=np.float64),
+                                                   frame['volume'].to_numpy(dtype=np.float64),
+                                                   frame['low'].to_numpy(dtype=np.float64),
+                                                   frame['high'].to_numpy(dtype=np.float64),
+                                                   close, settings)
+    day_start = datetime.combine(today, time()).timestamp()
+    day_end = datetime.combine(today + timedelta(days=1), time()).timestamp()
+    bar_time = frame['time'].to_numpy(dtype=np.float64)
+    passed &= (bar_time >= day_start) & (bar_time < day_end)
+    result = pd.DataFrame({'symbol': frame['symbol'].to_numpy()[passed],
+                           'price': close[passed],
+                           'target_price': target_price[passed],
+                           'gap': gap[passed],
+                           'volume': volume[passed]})
+    return result.sort_values(['gap', 'volume'], ascending=[True, False], kind='stable').reset_index(drop=True)
+
+
+def check_bars(yesterday_volume, volume, low, high, close, settings=parameters):
+    """ Vectorized checks of today's bars. Returns the mask of passed bars, target prices, gaps and volumes. """
+    volume = yesterday_volume + volume
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gap = close / low
+    passed = ~(volume < 2 * settings.getfloat('least trade volume'))
+    passed &= ~(gap > settings.getfloat('current-lowest gap'))
+    # Python's round() is used to get exactly the same target prices as the orders have
+    target_percent = 1 + settings.getfloat('check target percent')/100
+    target_price = np.zeros(len(close))
+    target_price[passed] = [round(price, 2) for price in (close[passed] * target_percent).tolist()]
+    passed &= (low <= target_price) & (target_price <= high)
+    return passed, target_price, gap, volume
@@ -0,0 +1,166 @@
+import os
+import time
+import queue
+import configparser
+import multiprocessing
+from collections import namedtuple, Counter
+
+import config
+from logs import log_this, logger, ERROR
+
+
+PROFILES_FILE = os.environ.get('PROFILES_FILE', 'profiles.ini')
+# seconds between restarts of a failed worker
+RESTART_DELAY = 60
+
+Profile = namedtuple('Profile', 'name directory shards')
+
+
+def read_profiles(path):
+    """ Reads the supervisor settings and the profiles. """
+    profiles_config = configparser.ConfigParser()
+    profiles_config.read(path)
+    profiles = [Profile(section[len('profile '):], os.path.abspath(profiles_config[section].get('directory')),
+                        profiles_config[section].getint('shards', fallback=1))
+                for section in profiles_config.sections() if section.startswith('profile ')]
+    return profiles_config['supervisor'], profiles
+
+
+def read_parameters(profile):
+    """ Reads the parameters of a profile. """
+    profile_config = configparser.ConfigParser()
+    profile_config.read(os.path.join(profile.directory, 'settings.ini'))
+    return profile_config['parameters']
+
+
+def get_overrides(parameters, shards):
+    """ Splits the initial funds and the order rate limit of a profile between its shards. """
+    if shards == 1:
+        return dict()
+    return {'initial funds': str(parameters.getfloat('initial funds') / shards),
+            'order rate limit': str(parameters.getfloat('order rate limit') / shards)}
+
+
+def run_worker(name, directory, settings_file, symbols_file, shard, overrides, hourly_window, statuses):
+    """ Runs the daemon for a shard of a profile. The settings of the supervisor have been read
+        when the worker imported this module, so the profile settings are read over them, and the other modules,
+        which read the settings at import, are imported after that. Only the first shard opens the streams
+        (their connections are limited per account), the others check orders and request minute bars. """
+    os.makedirs(directory, exist_ok=True)
+    os.chdir(directory)
+    config.SETTINGS_FILE = settings_file
+    config.config.read(settings_file)
+    for key, value in overrides.items():
+        config.parameters[key] = value
+    logger.configure(config.parameters)
+    import main
+    from limits import hourly_limiter
+    main.SYMBOLS_FILE = symbols_file
+    hourly_limiter.share(*hourly_window)
+    main.run_daemon(shard, report=lambda status: statuses.put((name, shard[0], time.time(), status)),
+                    streams=(shard[0] == 0))
+
+
+def aggregate(statuses):
+    """ Sums the last statuses of the shards of a profile. """
+    total = {'shards': 0, 'total_balance': 0, 'active_balance': 0, 'todays_profit': 0, 'counters': Counter()}
+    for status in statuses:
+        total['shards'] += 1
+        for key in ('total_balance', 'active_balance', 'todays_profit'):
+            total[key] += status[key]
+        total['counters'].update(status['counters'])
+    return total
+
+
+class Supervisor:
+    """ Runs every shard of every profile in a worker process, restarts failed workers
+        and logs the summed status of each profile. Shards of a profile share its hourly limitation. """
+
+    def __init__(self, profiles, status_interval):
+        self.profiles = profiles
+        self.status_interval = status_interval
+        self._context = multiprocessing.get_context('spawn')
+        self._statuses = self._context.Queue()
+        self._workers = dict()
+        self._started_at = dict()
+        self._args = dict()
+        self._hourly_windows = dict()
+        self._last_statuses = dict()
+
+    def start(self):
+        """ Starts the workers. """
+        for profile in self.profiles:
+            parameters = read_parameters(profile)
+            limit = parameters.getint('hourly limitation')
+            self._hourly_windows[profile.name] = (self._context.RawArray('d', limit), self._context.Lock())
+            overrides = get_overrides(parameters, profile.shards)
+            for index in range(profile.shards):
+                directory = profile.directory
+                if profile.shards > 1:
+                    directory = os.path.join(profile.directory, f'shard-{index}')
+                self._args[(profile.name, index)] = (profile.name, directory,
+                                                     os.path.join(profile.directory, 'settings.ini'),
+                                                     os.path.join(profile.directory, 'symbols.txt'),
+                                                     (index, profile.shards), overrides,
+                                                     self._hourly_windows[profile.name], self._statuses)
+                self._start((profile.name, index))
+
+    def _start(self, key):
+        process = self._context.Process(target=run_worker, args=self._args[key], name=f'{key[0]}-{key[1]}')
+        process.start()
+        self._workers[key] = process
+        self._started_at[key] = time.time()
+        log_this(f'Worker {key[0]} {key[1]} is started (pid {process.pid}).')
+
+    def supervise(self):
+        """ Collects statuses, restarts failed workers and logs the status until interrupted. """
+        next_status = time.time() + self.status_interval
+        while True:
+            try:
+                name, index, status_time, status = self._statuses.get(timeout=1)
+                self._last_statuses[(name, index)] = status
+            except queue.Empty:
+                pass
+            for key, process in self._workers.items():
+                if not process.is_alive() and time.time() - self._started_at[key] >= RESTART_DELAY:
+                    log_this(f'Worker {key[0]} {key[1]} has stopped (exit code {process.exitcode}). '
+                             f'Restarting...', level=ERROR)
+                    self._start(key)
+            if time.time() >= next_status:
+                next_status = time.time() + self.status_interval
+                self.log_status()
+
+    def log_status(self):
+        """ Logs the summed status of every profile. """
+        for profile in self.profiles:
+            total = aggregate(status for (name, _), status in self._last_statuses.items() if name == profile.name)
+            times, lock = self._hourly_windows[profile.name]
+            since = time.time() - 3600
+            with lock:
+                hourly_orders = sum(1 for submitted_at in times if submitted_at >= since)
+            log_this(f"Profile {profile.name}: {total['shards']} of {profile.shards} shards reported. "
+                     f"Total balance: ${total['total_balance']:.2f}, active balance: ${total['active_balance']:.2f}, "
+                     f"today's profit: ${total['todays_profit']:.2f}, "
+                     f"buy orders in the last hour: {hourly_orders} of {len(times)}. "
+                     f"Last scans: {total['counters']['candidates']} candidates, "
+                     f"{total['counters']['buy_orders_placed']} buy orders placed.")
+
+    def stop(self, timeout=30):
+        """ Waits for the workers (they are interrupted together with the supervisor) and terminates the rest. """
+        for process in self._workers.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+
+if __name__ == '__main__':
+    supervisor_parameters, profiles = read_profiles(PROFILES_FILE)
+    supervisor = Supervisor(profiles, supervisor_parameters.getfloat('status interval'))
+    log_this(f'Supervisor is running {sum(profile.shards for profile in profiles)} workers '
+             f'of {len(profiles)} profiles', notime_flag=True)
+    supervisor.start()
+    try:
+        supervisor.supervise()
+    except KeyboardInterrupt:
+        supervisor.stop()
+        log_this('Supervisor is stopped.')
@@ -0,0 +1,9 @@
+import pytest
+
+from fake_broker import FakeREST
+
+
+@pytest.fixture
+def api(workdir):
+    """ A fake broker of a small universe. """
+    return FakeREST(100)
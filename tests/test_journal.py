@@ -0,0 +1,79 @@
+import database
+from config import parameters
+from database import get_list_of_orders, get_balance
+from journal import journal, OPEN, APPLIED, FAILED
+from orders import submit_order, make_limit_buy_order, apply_buy_orders
+from orders_checks import recover_orders, check_orders, RECOVERY_PAGE_SIZE
+
+SYMBOL = 'S00000'
+
+
+def test_order_submitted_before_crash_is_recovered_once(api):
+    price = api.prices[SYMBOL]
+    journal.open_intent('crashed', SYMBOL, 'buy', 'limit', 10, price)
+    # The order has reached the broker, but the bot has crashed before recording it
+    order = api.submit_order(SYMBOL, qty='10', side='buy', type='limit', limit_price=price,
+                             client_order_id='crashed')
+    recover_orders(api)
+    assert get_list_of_orders('buy_orders') == [order.id]
+    assert journal.get_intent('crashed').status == APPLIED
+    assert get_balance('total') == parameters.getfloat('initial funds') - 10 * price
+    recover_orders(api)
+    assert get_list_of_orders('buy_orders') == [order.id]
+    assert get_balance('total') == parameters.getfloat('initial funds') - 10 * price
+
+
+def test_order_not_submitted_before_crash_fails(api):
+    journal.open_intent('lost', SYMBOL, 'buy', 'limit', 10, api.prices[SYMBOL])
+    recover_orders(api)
+    assert journal.get_intent('lost').status == FAILED
+    assert get_list_of_orders('buy_orders') == []
+    assert api.calls['submit_order'] == 0
+
+
+def test_open_intent_is_not_submitted_twice(api):
+    journal.open_intent('sell-buy', SYMBOL, 'sell', 'limit', 10, 1.0, 'buy')
+    order = api.submit_order(SYMBOL, qty='10', side='sell', type='limit', limit_price=1.0,
+                             client_order_id='sell-buy')
+    resubmitted = submit_order(api, 'sell-buy', 'buy', symbol=SYMBOL, side='sell', type='limit', qty='10',
+                               time_in_force='gtc', limit_price=1.0)
+    assert resubmitted.id == order.id
+    assert len(api.orders) == 1
+    assert journal.get_intent('sell-buy').status == OPEN
+
+
+def test_sell_order_unrecorded_after_failed_write_is_recovered(api):
+    make_limit_buy_order(api, SYMBOL, 10, api.prices[SYMBOL])
+    apply_buy_orders(api, wait=True)
+    buy_order_id, = get_list_of_orders('buy_orders')
+    api.advance()
+    conn = database.db.connection()
+    conn.execute('CREATE TRIGGER fail_sell BEFORE INSERT ON sell_orders BEGIN SELECT RAISE(ABORT, "failed"); END')
+    check_orders(api)
+    # The sell order is submitted, but its record has failed, so the buy order is kept
+    assert get_list_of_orders('buy_orders') == [buy_order_id]
+    assert get_list_of_orders('sell_orders') == []
+    assert journal.get_intent(f'sell-{buy_order_id}').status == OPEN
+    conn.execute('DROP TRIGGER fail_sell')
+    recover_orders(api)
+    sell_order_id, = get_list_of_orders('sell_orders')
+    assert api.orders[sell_order_id]['client_order_id'] == f'sell-{buy_order_id}'
+    assert journal.get_intent(f'sell-{buy_order_id}').status == APPLIED
+    check_orders(api)
+    assert get_list_of_orders('buy_orders') == []
+    assert get_list_of_orders('sell_orders') == [sell_order_id]
+    assert len(api.orders) == 2
+
+
+def test_recovery_pages_through_orders(api):
+    journal.open_intent('lost', SYMBOL, 'buy', 'limit', 10, api.prices[SYMBOL])
+    for _ in range(RECOVERY_PAGE_SIZE + 100):
+        api.submit_order(SYMBOL, qty='1', side='buy', type='market')
+    journal.open_intent('crashed', SYMBOL, 'buy', 'limit', 10, api.prices[SYMBOL])
+    order = api.submit_order(SYMBOL, qty='10', side='buy', type='limit', limit_price=api.prices[SYMBOL],
+                             client_order_id='crashed')
+    recover_orders(api)
+    assert api.calls['list_orders'] == 2
+    assert get_list_of_orders('buy_orders') == [order.id]
+    assert journal.get_intent('crashed').status == APPLIED
+    assert journal.get_intent('lost').status == FAILED
@@ -0,0 +1,68 @@
+import multiprocessing
+
+from limits import HourlyLimiter, hourly_limiter
+from orders import make_limit_buy_order, apply_buy_orders, pending_buys
+from fake_broker import api_error
+
+SYMBOL = 'S00000'
+
+
+def reject(*args, **kwargs):
+    raise api_error(403, 40310000, 'insufficient buying power')
+
+
+def shared_window(limit):
+    context = multiprocessing.get_context('spawn')
+    return context.RawArray('d', limit), context.Lock()
+
+
+def test_shards_share_the_limitation(api):
+    window = shared_window(3)
+    shards = [HourlyLimiter(3), HourlyLimiter(3)]
+    for limiter in shards:
+        limiter.share(*window)
+    # Queued orders of both shards take slots before any of them is submitted
+    reserved = [limiter.reserve(f'{index}-{number}') for number in range(3) for index, limiter in enumerate(shards)]
+    assert reserved.count(True) == 3
+    assert all(limiter.is_reached() for limiter in shards)
+    shards[0].release('0-0')
+    assert not shards[1].is_reached()
+    assert shards[1].reserve('1-3')
+    assert shards[0].is_reached()
+
+
+def test_submitted_order_keeps_its_slot(api):
+    window = shared_window(2)
+    limiter = HourlyLimiter(2)
+    limiter.share(*window)
+    assert limiter.reserve('first')
+    limiter.register('order', 'first')
+    assert sum(1 for time in window[0] if time) == 1
+    assert limiter.reserve('second')
+    assert not limiter.reserve('third')
+
+
+def test_zero_limitation(api):
+    limiter = HourlyLimiter(0)
+    limiter.share(*shared_window(0))
+    assert limiter.is_reached()
+    assert not limiter.reserve('order')
+    limiter.register('order')
+
+
+def test_failed_buy_order_frees_its_slot(api, monkeypatch):
+    window = shared_window(2)
+    monkeypatch.setattr(hourly_limiter, 'limit', 2)
+    monkeypatch.setattr(hourly_limiter, '_shared', window)
+    for _ in range(3):
+        make_limit_buy_order(api, SYMBOL, 1, api.prices[SYMBOL])
+    assert len(pending_buys) == 2
+    apply_buy_orders(api, wait=True)
+    assert len(api.orders) == 2
+    assert hourly_limiter.is_reached()
+    # A rejected order gives its slot back
+    window[0][0] = window[0][1] = 0
+    monkeypatch.setattr(api, 'submit_order', reject)
+    make_limit_buy_order(api, SYMBOL, 1, api.prices[SYMBOL])
+    apply_buy_orders(api, wait=True)
+    assert not any(window[0])
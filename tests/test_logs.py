@@ -0,0 +1,19 @@
+import logs
+from logs import Logger, INFO
+
+
+def test_failed_log_file_stops_writing(tmp_path, monkeypatch, capsys):
+    (tmp_path / 'logs').write_text('')
+    # A file is in the place of the logs directory, so the log file can't be opened
+    monkeypatch.setattr(logs, 'LOGS_DIR', f'{tmp_path / "logs"}/')
+    logger = Logger(INFO, True, False)
+    for number in range(10):
+        logger.log('Record %s', number)
+    logger._thread.join(5)
+    assert not logger._thread.is_alive()
+    assert not logger.to_file
+    assert logger._queue.empty()
+    assert 'Logging to file is stopped' in capsys.readouterr().err
+    logger.log('Another record')
+    assert logger._queue.empty()
+    logger.flush()
@@ -0,0 +1,102 @@
+import time
+import threading
+import pytest
+import requests
+from alpaca_trade_api.rest import APIError
+
+from order_queue import OrderQueue, TokenBucket, is_transient
+from orders import send_order
+from fake_broker import api_error
+
+SYMBOL = 'S00000'
+
+
+class Flaky:
+    """ Raises the errors one by one and then returns 'done'. """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'done'
+
+
+@pytest.fixture
+def order_queue(monkeypatch):
+    monkeypatch.setattr('order_queue.BACKOFF_BASE', 0)
+    return OrderQueue(workers=2, rate_per_minute=60000, retries=3)
+
+
+def test_transient_errors_are_retried(order_queue):
+    function = Flaky(requests.exceptions.ConnectionError(), api_error(429, 42910000, 'rate limit exceeded'),
+                     api_error(503, 50310000, 'service unavailable'))
+    assert order_queue.call('key', function).result() == 'done'
+    assert function.calls == 4
+
+
+def test_rejected_order_is_not_retried(order_queue):
+    function = Flaky(api_error(422, 40010001, 'asset not found'))
+    with pytest.raises(APIError):
+        order_queue.call('key', function).result()
+    assert function.calls == 1
+
+
+def test_retries_are_limited(order_queue):
+    function = Flaky(*[requests.exceptions.Timeout()] * 5)
+    with pytest.raises(requests.exceptions.Timeout):
+        order_queue.call('key', function).result()
+    assert function.calls == 4
+
+
+def test_pending_request_is_deduplicated(order_queue):
+    released = threading.Event()
+    calls = list()
+
+    def function():
+        calls.append(1)
+        released.wait(5)
+        return 'done'
+    first = order_queue.call('key', function)
+    second = order_queue.call('key', function)
+    released.set()
+    assert second is first
+    assert first.result() == 'done'
+    assert len(calls) == 1
+    # A finished request is forgotten, so the key can be used again
+    assert order_queue.call('key', function).result() == 'done'
+    assert len(calls) == 2
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=2)
+    started_at = time.monotonic()
+    for _ in range(7):
+        bucket.acquire()
+    # Two calls are a burst, the other five wait for tokens
+    assert time.monotonic() - started_at >= 5 / 50 * 0.9
+
+
+def test_is_transient():
+    assert is_transient(requests.exceptions.ConnectionError())
+    assert is_transient(api_error(429, 42910000, 'rate limit exceeded'))
+    assert is_transient(api_error(500, 50010000, 'internal server error'))
+    assert not is_transient(api_error(422, 40010001, 'client_order_id must be unique'))
+    assert not is_transient(ValueError())
+
+
+def test_taken_client_order_id_returns_submitted_order(api):
+    order = send_order(api, 'taken', symbol=SYMBOL, qty='1', side='buy', type='market', time_in_force='day')
+    again = send_order(api, 'taken', symbol=SYMBOL, qty='1', side='buy', type='market', time_in_force='day')
+    assert again.id == order.id
+    assert len(api.orders) == 1
+
+
+def test_rejected_order_keeps_its_error(api):
+    with pytest.raises(APIError) as error:
+        send_order(api, 'rejected', symbol='UNKNOWN', qty='1', side='buy', type='market', time_in_force='day')
+    assert error.value.status_code == 422
+    assert api.calls['get_order_by_client_order_id'] == 1
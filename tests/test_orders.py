@@ -0,0 +1,123 @@
+from config import parameters
+from database import get_list_of_orders, get_balance, get_total_profit, get_buy_order_id
+from journal import journal, APPLIED, FAILED
+from orders import make_limit_buy_order, apply_buy_orders, pending_buys
+from orders_checks import check_orders, sell_target_price
+from fake_broker import api_error
+
+SYMBOL = 'S00000'
+QUANTITY = 10
+
+
+def buy(api):
+    """ Places a limit buy order at the last price and returns its broker record. """
+    price = api.prices[SYMBOL]
+    make_limit_buy_order(api, SYMBOL, QUANTITY, price)
+    apply_buy_orders(api, wait=True)
+    buy_order_id, = get_list_of_orders('buy_orders')
+    return api.orders[buy_order_id]
+
+
+def test_buy_order_reserves_funds(api):
+    initial_funds = parameters.getfloat('initial funds')
+    buy_order = buy(api)
+    assert buy_order['side'] == 'buy' and buy_order['status'] == 'new'
+    assert get_balance('total') == initial_funds - QUANTITY * api.prices[SYMBOL]
+    assert get_balance('active') == initial_funds - QUANTITY * api.prices[SYMBOL]
+
+
+def test_filled_buy_order_is_sold_with_profit(api):
+    initial_funds = parameters.getfloat('initial funds')
+    buy_order = buy(api)
+    api.advance()
+    check_orders(api)
+    assert get_list_of_orders('buy_orders') == []
+    sell_order_id, = get_list_of_orders('sell_orders')
+    sell_order = api.orders[sell_order_id]
+    assert sell_order['client_order_id'] == f"sell-{buy_order['id']}"
+    assert sell_order['type'] == 'limit'
+    assert float(sell_order['limit_price']) == sell_target_price(buy_order['limit_price'])
+    assert get_buy_order_id(sell_order_id) == buy_order['id']
+    api.advance()
+    check_orders(api)
+    assert get_list_of_orders('sell_orders') == []
+    profit = QUANTITY * (float(sell_order['limit_price']) - float(buy_order['limit_price']))
+    assert get_total_profit() == round(profit, 2)
+    assert round(get_balance('total'), 2) == round(initial_funds + profit, 2)
+
+
+def test_filled_sell_orders_are_checked_by_snapshot(api, monkeypatch):
+    # Buy orders are older than sell orders, so they are on the last pages
+    monkeypatch.setattr('orders_checks.SNAPSHOT_PAGE_SIZE', 2)
+    for symbol in ('S00000', 'S00001', 'S00002'):
+        make_limit_buy_order(api, symbol, QUANTITY, api.prices[symbol])
+    apply_buy_orders(api, wait=True)
+    api.advance()
+    check_orders(api)
+    api.advance()
+    api.calls.clear()
+    check_orders(api)
+    assert get_list_of_orders('sell_orders') == []
+    assert api.calls['get_order'] == 0
+
+
+def test_expired_sell_order_is_replaced_by_market_order(api):
+    buy(api)
+    api.advance()
+    check_orders(api)
+    sell_order_id, = get_list_of_orders('sell_orders')
+    api.advance(minutes=parameters.getint('sell-order lifetime'), fill_ratio=0)
+    check_orders(api)
+    assert api.orders[sell_order_id]['status'] == 'canceled'
+    market_order_id, = get_list_of_orders('sell_orders')
+    market_order = api.orders[market_order_id]
+    assert market_order['client_order_id'] == f'resell-{sell_order_id}'
+    assert market_order['type'] == 'market'
+    api.advance()
+    check_orders(api)
+    assert get_list_of_orders('sell_orders') == []
+
+
+def test_expired_buy_order_is_canceled_and_refunded(api):
+    initial_funds = parameters.getfloat('initial funds')
+    buy_order = buy(api)
+    api.advance(minutes=parameters.getint('buy-order checking time'), fill_ratio=0)
+    check_orders(api)
+    assert api.orders[buy_order['id']]['status'] == 'canceled'
+    assert get_list_of_orders('buy_orders') == []
+    assert get_list_of_orders('sell_orders') == []
+    assert get_balance('total') == initial_funds
+    assert get_balance('active') == initial_funds
+
+
+def fail_submissions(api, monkeypatch, status_code, is_placed):
+    """ Makes every submission fail with the status code after the first one has placed its order if is_placed. """
+    submit_order = api.submit_order
+
+    def failing_submit_order(*args, **kwargs):
+        if is_placed and not api.orders:
+            submit_order(*args, **kwargs)
+        raise api_error(status_code, status_code * 100000, 'failed')
+    monkeypatch.setattr('order_queue.BACKOFF_BASE', 0)
+    monkeypatch.setattr(api, 'submit_order', failing_submit_order)
+
+
+def test_buy_order_placed_despite_server_error_is_recorded(api, monkeypatch):
+    fail_submissions(api, monkeypatch, 502, is_placed=True)
+    make_limit_buy_order(api, SYMBOL, QUANTITY, api.prices[SYMBOL])
+    client_order_id, = pending_buys
+    apply_buy_orders(api, wait=True)
+    buy_order_id, = api.orders
+    assert get_list_of_orders('buy_orders') == [buy_order_id]
+    assert get_balance('total') == parameters.getfloat('initial funds') - QUANTITY * api.prices[SYMBOL]
+    assert journal.get_intent(client_order_id).status == APPLIED
+
+
+def test_buy_order_not_placed_after_server_error_fails(api, monkeypatch):
+    fail_submissions(api, monkeypatch, 504, is_placed=False)
+    make_limit_buy_order(api, SYMBOL, QUANTITY, api.prices[SYMBOL])
+    client_order_id, = pending_buys
+    apply_buy_orders(api, wait=True)
+    assert get_list_of_orders('buy_orders') == []
+    assert get_balance('total') == parameters.getfloat('initial funds')
+    assert journal.get_intent(client_order_id).status == FAILED
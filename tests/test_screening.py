@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+from config import parameters
+from fake_broker import make_universe
+from screening import bars_to_frame, screen
+
+
+def currency_checking(bars):
+    """ The former check of a symbol by its two daily bars, one symbol at a time. """
+    if len(bars) < 2:
+        return False, 0
+    yesterday_bar, today_bar = bars[0], bars[1]
+    if datetime.date(datetime.fromtimestamp(today_bar['t'])) != datetime.date(datetime.utcnow()):
+        return False, 0
+    if yesterday_bar['v'] + today_bar['v'] < 2 * parameters.getfloat('least trade volume'):
+        return False, 0
+    if today_bar['c'] / today_bar['l'] > parameters.getfloat('current-lowest gap'):
+        return False, 0
+    target_price = round(today_bar['c'] * (1 + parameters.getfloat('check target percent')/100), 2)
+    if not today_bar['l'] <= target_price <= today_bar['h']:
+        return False, 0
+    return True, today_bar['c']
+
+
+def test_screen_matches_currency_checking():
+    _, bars = make_universe(2000, seed=1)
+    # Bars of another day and a symbol without yesterday's bar are dropped
+    bars['S00000'] = [dict(bar, t=bar['t'] - 86400) for bar in bars['S00000']]
+    bars['S00001'] = bars['S00001'][1:]
+    expected = dict()
+    for symbol, symbol_bars in bars.items():
+        passed, price = currency_checking(symbol_bars)
+        if passed:
+            expected[symbol] = price
+    result = screen(bars_to_frame(bars.items()), today=datetime.utcnow().date())
+    assert expected
+    assert dict(zip(result['symbol'], result['price'])) == expected
+
+
+def test_screen_orders_by_gap_and_volume():
+    _, bars = make_universe(2000, seed=2)
+    result = screen(bars_to_frame(bars.items()), today=datetime.utcnow().date())
+    keys = list(zip(result['gap'], -result['volume']))
+    assert keys == sorted(keys)
+
+
+def test_screen_of_another_day_is_empty():
+    _, bars = make_universe(200)
+    result = screen(bars_to_frame(bars.items()), today=datetime.utcnow().date() + timedelta(days=1))
+    assert result.empty
@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+
+from config import parameters
+from database import get_list_of_orders, get_balance
+from orders import make_limit_buy_order, apply_buy_orders
+from orders_checks import check_order_update, sell_target_price
+from trade_updates import TradeUpdates
+
+SYMBOL = 'S00000'
+QUANTITY = 10
+
+
+@pytest.fixture
+def trade_updates():
+    """ The stream is never run: events are fed to its handler as the stream would. """
+    return TradeUpdates('key', 'secret', 'https://paper-api.alpaca.markets')
+
+
+def send_event(trade_updates, api, event, order_id):
+    """ Feeds an event of the order as the stream does and handles the queued events like the daemon. """
+    asyncio.run(trade_updates._on_trade_update(SimpleNamespace(event=event, order=dict(api.orders[order_id]))))
+    for event, order in trade_updates.wait(0):
+        check_order_update(api, event, order)
+
+
+def buy(api):
+    make_limit_buy_order(api, SYMBOL, QUANTITY, api.prices[SYMBOL])
+    apply_buy_orders(api, wait=True)
+    buy_order_id, = get_list_of_orders('buy_orders')
+    return buy_order_id
+
+
+def test_fill_of_buy_order_places_sell_order(api, trade_updates):
+    buy_order_id = buy(api)
+    api.advance()
+    send_event(trade_updates, api, 'fill', buy_order_id)
+    assert get_list_of_orders('buy_orders') == []
+    sell_order_id, = get_list_of_orders('sell_orders')
+    sell_order = api.orders[sell_order_id]
+    assert sell_order['client_order_id'] == f'sell-{buy_order_id}'
+    assert sell_order['type'] == 'limit'
+    assert float(sell_order['limit_price']) == sell_target_price(api.orders[buy_order_id]['limit_price'])
+
+
+def test_canceled_buy_order_releases_funds(api, trade_updates):
+    buy_order_id = buy(api)
+    api.cancel_order(buy_order_id)
+    send_event(trade_updates, api, 'canceled', buy_order_id)
+    assert get_list_of_orders('buy_orders') == []
+    assert get_list_of_orders('sell_orders') == []
+    assert get_balance('total') == parameters.getfloat('initial funds')
+    assert get_balance('active') == parameters.getfloat('initial funds')
+
+
+def test_update_of_untracked_order_is_ignored(api, trade_updates):
+    order = api.submit_order(SYMBOL, qty='1', side='buy', type='market')
+    api.advance()
+    send_event(trade_updates, api, 'fill', order.id)
+    assert get_list_of_orders('buy_orders') == []
+    assert get_list_of_orders('sell_orders') == []
+    assert len(api.orders) == 1
+    assert api.calls['get_order'] == 0
+
+
+def test_other_events_are_not_queued(api, trade_updates):
+    buy_order_id = buy(api)
+    asyncio.run(trade_updates._on_trade_update(SimpleNamespace(event='new', order=dict(api.orders[buy_order_id]))))
+    assert trade_updates.wait(0) == []
@@ -0,0 +1,50 @@
+import asyncio
+import queue
+import threading
+from alpaca_trade_api.stream import Stream
+from alpaca_trade_api.entity import Order
+
+from logs import log_this, ERROR
+
+
+ORDER_EVENTS = ('fill', 'partial_fill', 'canceled')
+
+
+class TradeUpdates:
+    """ Listens to the trade_updates stream in a background thread.
+        Order events are queued and handled by the main thread. """
+
+    def __init__(self, api_key, api_secret, base_url):
+        self._events = queue.Queue()
+        self._stream = Stream(api_key, api_secret, base_url)
+        self._stream.subscribe_trade_updates(self._on_trade_update)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """ Starts listening. """
+        self._thread.start()
+
+    def is_alive(self):
+        """ Checks whether the stream is still listened to. """
+        return self._thread.is_alive()
+
+    def wait(self, timeout):
+        """ Waits for order events up to timeout seconds and returns all of them. """
+        events = list()
+        try:
+            events.append(self._events.get(timeout=timeout))
+            while True:
+                events.append(self._events.get_nowait())
+        except queue.Empty:
+            return events
+
+    def _run(self):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        try:
+            self._stream.run()
+        except Exception as error:
+            log_this(f'Trade updates stream is stopped! ({error!r})', level=ERROR)
+
+    async def _on_trade_update(self, data):
+        if data.event in ORDER_EVENTS:
+            self._events.put((data.event, Order(data.order)))